@@ -0,0 +1,211 @@
+"""
+bootstrap_rarity_stability.py
+─────────────────────────────────────────────────────────────────────────────
+Bootstrap stability analysis for the rarity-group assignment.
+
+`assign_group` places a patient in ultra_rare / rare / common using the
+k-anonymity cut points (k <= 2, k <= 5) and the p95 / p75 quantiles of
+I_total. Both the counts and the quantiles are estimated from a single
+cohort of ~1,000 patients, so a patient near a boundary may flip group
+under a slightly different cohort.
+
+This module resamples the cohort B times with replacement, recomputes the
+profile counts, I_total and the p75/p95 thresholds inside every replicate,
+and reports how often each patient's rarity_group differs from its
+assignment on the observed cohort. Resampling is done with NumPy index
+matrices (replicates × patients) and `np.bincount`, so there is no
+per-replicate Python loop; 10,000 replicates take a few seconds.
+
+A patient is only scored in replicates where it was actually drawn.
+
+Output:
+  data/processed/rarity_stability.csv
+    patient_id | rarity_group | n_drawn | flip_rate | p_common | p_rare | p_ultra_rare
+
+Run:
+  python src/02_rarity_analysis/bootstrap_rarity_stability.py
+  python src/02_rarity_analysis/bootstrap_rarity_stability.py --replicates 2000
+"""
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '01_dataset_processing')))
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# ── Group definitions (must mirror assign_group) ──────────────────────────────
+ULTRA_RARE_K        = 2
+RARE_K              = 5
+ULTRA_RARE_QUANTILE = 0.95
+RARE_QUANTILE       = 0.75
+
+GROUP_NAMES = ["common", "rare", "ultra_rare"]   # index == group code
+
+# ── Bootstrap defaults ────────────────────────────────────────────────────────
+N_REPLICATES = 10_000
+CHUNK_SIZE   = 1_000     # replicates materialized at once (bounds memory)
+SEED         = 42
+
+
+def encode_profile_codes(gen_profiles, phen_profiles, traj_profiles):
+    """
+    Map each patient's profile tuples to dense integer codes.
+
+    Returns a dict with one int array per axis ("gen", "phen", "traj") plus
+    "full", the code of the joint (gen, phen, traj) profile used for k_full.
+    """
+    codes = {}
+    for axis, profiles in (("gen", gen_profiles), ("phen", phen_profiles), ("traj", traj_profiles)):
+        lookup = {}
+        codes[axis] = np.array([lookup.setdefault(p, len(lookup)) for p in profiles], dtype=np.int64)
+
+    stacked = np.stack([codes["gen"], codes["phen"], codes["traj"]], axis=1)
+    _, codes["full"] = np.unique(stacked, axis=0, return_inverse=True)
+    codes["full"] = codes["full"].reshape(-1).astype(np.int64)
+    return codes
+
+
+def _replicate_counts(codes, idx):
+    """Per-replicate frequency of every code: (B, K) from a (B, N) index matrix."""
+    B = idx.shape[0]
+    K = int(codes.max()) + 1
+    flat = codes[idx] + (np.arange(B, dtype=np.int64)[:, None] * K)
+    return np.bincount(flat.ravel(), minlength=B * K).reshape(B, K)
+
+
+def assign_groups(I_total, k_full, p95, p75,
+                  ultra_rare_k=ULTRA_RARE_K, rare_k=RARE_K):
+    """Vectorized assign_group: returns group codes (0=common, 1=rare, 2=ultra_rare)."""
+    ultra = (k_full <= ultra_rare_k) | (I_total >= p95)
+    rare = (k_full <= rare_k) | (I_total >= p75)
+    return np.where(ultra, 2, np.where(rare, 1, 0)).astype(np.int8)
+
+
+def score_replicates(codes, idx,
+                     ultra_rare_quantile=ULTRA_RARE_QUANTILE, rare_quantile=RARE_QUANTILE,
+                     ultra_rare_k=ULTRA_RARE_K, rare_k=RARE_K):
+    """
+    Recompute rarity groups for every original patient inside each replicate.
+
+    idx is a (B, N) matrix of drawn patient indices. Returns (groups, drawn):
+    groups is (B, N) int8, drawn is (B, N) int with the number of times each
+    patient was drawn in each replicate (groups are meaningless where drawn == 0).
+    """
+    B, N = idx.shape
+
+    I_total = np.zeros((B, N), dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        for axis in ("gen", "phen", "traj"):
+            counts = _replicate_counts(codes[axis], idx)[:, codes[axis]]
+            I_total -= np.log10(counts / N)
+    k_full = _replicate_counts(codes["full"], idx)[:, codes["full"]]
+
+    # Thresholds are quantiles of the resampled cohort (drawn rows only)
+    cohort_I = np.take_along_axis(I_total, idx, axis=1)
+    p95 = np.quantile(cohort_I, ultra_rare_quantile, axis=1)[:, None]
+    p75 = np.quantile(cohort_I, rare_quantile, axis=1)[:, None]
+
+    groups = assign_groups(I_total, k_full, p95, p75, ultra_rare_k, rare_k)
+    drawn = _replicate_counts(np.arange(N, dtype=np.int64), idx)
+    return groups, drawn
+
+
+def bootstrap_group_stability(codes, n_replicates=N_REPLICATES, seed=SEED,
+                              chunk_size=CHUNK_SIZE, **thresholds):
+    """
+    Resample the cohort n_replicates times and summarize group flips per patient.
+
+    Returns (baseline_groups, summary) where baseline_groups are the group codes
+    on the observed cohort and summary is a DataFrame indexed by patient index.
+    """
+    N = len(codes["full"])
+    rng = np.random.default_rng(seed)
+
+    identity = np.arange(N, dtype=np.int64)[None, :]
+    baseline, _ = score_replicates(codes, identity, **thresholds)
+    baseline = baseline[0]
+
+    n_drawn = np.zeros(N, dtype=np.int64)
+    group_hits = np.zeros((len(GROUP_NAMES), N), dtype=np.int64)
+
+    for start in range(0, n_replicates, chunk_size):
+        b = min(chunk_size, n_replicates - start)
+        idx = rng.integers(0, N, size=(b, N), dtype=np.int64)
+        groups, drawn = score_replicates(codes, idx, **thresholds)
+        present = drawn > 0
+        n_drawn += present.sum(axis=0)
+        for g in range(len(GROUP_NAMES)):
+            group_hits[g] += ((groups == g) & present).sum(axis=0)
+
+    denom = np.maximum(n_drawn, 1)
+    summary = pd.DataFrame({
+        "n_drawn":   n_drawn,
+        "flip_rate": 1.0 - group_hits[baseline, identity[0]] / denom,
+    })
+    for g, name in enumerate(GROUP_NAMES):
+        summary[f"p_{name}"] = group_hits[g] / denom
+    return baseline, summary
+
+
+def print_stability_summary(df_stability):
+    print("\n--- Rarity Group Bootstrap Stability ---")
+    for group, gdf in df_stability.groupby("rarity_group"):
+        print(f"  {group:<11} n={len(gdf):>4}  mean flip={gdf['flip_rate'].mean()*100:5.1f}%  "
+              f"flip>25%: {(gdf['flip_rate'] > 0.25).sum():>4}  "
+              f"flip>50%: {(gdf['flip_rate'] > 0.50).sum():>4}")
+
+
+def build_stability_table(patient_ids, rarity_groups, codes, n_replicates=N_REPLICATES, seed=SEED):
+    """Run the bootstrap and return a per-patient stability DataFrame."""
+    baseline, summary = bootstrap_group_stability(codes, n_replicates=n_replicates, seed=seed)
+
+    observed = [GROUP_NAMES[g] for g in baseline]
+    n_mismatch = sum(a != b for a, b in zip(rarity_groups, observed))
+    if n_mismatch:
+        # Only possible for patients sitting exactly on a quantile (float rounding)
+        print(f"Warning: {n_mismatch} patient(s) differ between assign_group and the vectorized assignment")
+
+    summary.insert(0, "rarity_group", list(rarity_groups))
+    summary.insert(0, "patient_id", list(patient_ids))
+    return summary
+
+
+def main():
+    from compute_rarity_scores import get_genetic_profile, get_phenotype_profile, get_trajectory_profile
+    from config import CSV_PATH, PROCESSED_DIR
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replicates", type=int, default=N_REPLICATES)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    print("Loading Dataset...")
+    df = pd.read_csv(CSV_PATH, encoding="cp1252")
+
+    codes = encode_profile_codes(
+        [get_genetic_profile(row) for _, row in df.iterrows()],
+        [get_phenotype_profile(row) for _, row in df.iterrows()],
+        [get_trajectory_profile(row) for _, row in df.iterrows()],
+    )
+
+    print(f"Running {args.replicates} bootstrap replicates...")
+    t0 = time.perf_counter()
+    baseline, summary = bootstrap_group_stability(codes, n_replicates=args.replicates, seed=args.seed)
+    print(f"  done in {time.perf_counter() - t0:.1f}s")
+
+    summary.insert(0, "rarity_group", [GROUP_NAMES[g] for g in baseline])
+    summary.insert(0, "patient_id", [f"row_{i}" for i in range(len(df))])
+    print_stability_summary(summary)
+
+    out_path = os.path.join(PROCESSED_DIR, "rarity_stability.csv")
+    summary.to_csv(out_path, index=False)
+    print(f"\nSaved stability table to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
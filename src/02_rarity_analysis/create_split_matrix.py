@@ -0,0 +1,219 @@
+"""
+create_split_matrix.py
+─────────────────────────────────────────────────────────────────────────────
+Generates many stratified train/test splits in one run, for error bars on
+memorization rates.
+
+Two modes:
+  --repeats R   R repeated 80/20 splits stratified by rarity_group, using
+                seeds SPLIT_SEED, SPLIT_SEED+1, ... Replicate 0 reproduces
+                splits.csv exactly.
+  --folds K     K stratified folds; replicate k holds fold k out as test.
+
+The splits are stored as one compact int8 matrix (patients × replicates,
+1 = test, 0 = train) instead of one splits.csv per seed:
+
+  data/processed/split_matrix_repeats.npz   (or split_matrix_folds.npz)
+    patient_ids | rarity_groups | matrix | seeds | mode
+
+Training JSONL and general eval prompts for a replicate are only written
+when requested with --materialize, and are streamed straight from the card
+files without holding the corpus in memory:
+
+  data/processed/replicates/{mode}_r{r}/tinker_train_{variant}.jsonl
+  data/processed/replicates/{mode}_r{r}/eval_prompts.jsonl
+
+Run:
+  python src/02_rarity_analysis/create_split_matrix.py --repeats 20
+  python src/02_rarity_analysis/create_split_matrix.py --folds 5
+  python src/02_rarity_analysis/create_split_matrix.py --repeats 20 --materialize 3 7
+"""
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    CSV_PATH, PROCESSED_DIR, PARTIAL_CARDS_PATH, FULL_CARDS_PATH,
+    COARSENED_CARDS_PATH, EXACT_CARDS_PATH
+)
+from create_splits_and_prompts import score_patients, stratified_test_indices, SPLIT_SEED, TEST_FRACTION
+
+REPLICATES_DIR = os.path.join(PROCESSED_DIR, "replicates")
+
+# Assistant-side card file for each training variant (prompt is always the partial card)
+TRAINING_VARIANTS = {
+    "M1_full":      FULL_CARDS_PATH,
+    "M2_coarsened": COARSENED_CARDS_PATH,
+    "M1_exact":     EXACT_CARDS_PATH,
+}
+
+PROMPT_PREFIX = "Please complete the clinical summary for this patient:\n\n"
+
+
+def matrix_path(mode):
+    return os.path.join(PROCESSED_DIR, f"split_matrix_{mode}.npz")
+
+
+def repeated_split_matrix(df_patients, n_repeats, base_seed=SPLIT_SEED, test_fraction=TEST_FRACTION):
+    """(patients × n_repeats) int8 matrix of repeated stratified splits (1 = test)."""
+    seeds = [base_seed + r for r in range(n_repeats)]
+    matrix = np.zeros((len(df_patients), n_repeats), dtype=np.int8)
+    for r, seed in enumerate(seeds):
+        test_idx = stratified_test_indices(df_patients, seed=seed, test_fraction=test_fraction)
+        matrix[df_patients.index.get_indexer(test_idx), r] = 1
+    return matrix, seeds
+
+
+def kfold_split_matrix(df_patients, n_folds, seed=SPLIT_SEED):
+    """(patients × n_folds) int8 matrix of stratified folds; column k tests fold k."""
+    fold = np.empty(len(df_patients), dtype=np.int64)
+    for group, group_df in df_patients.groupby("rarity_group"):
+        shuffled = group_df.sample(frac=1, random_state=seed).index
+        # Deal each stratum round-robin so every fold gets its share of every group
+        fold[df_patients.index.get_indexer(shuffled)] = np.arange(len(shuffled)) % n_folds
+    matrix = (fold[:, None] == np.arange(n_folds)[None, :]).astype(np.int8)
+    return matrix, [seed] * n_folds
+
+
+def save_split_matrix(path, df_patients, matrix, seeds, mode):
+    np.savez_compressed(
+        path,
+        patient_ids=df_patients["patient_id"].to_numpy(dtype=str),
+        rarity_groups=df_patients["rarity_group"].to_numpy(dtype=str),
+        matrix=matrix,
+        seeds=np.asarray(seeds, dtype=np.int64),
+        mode=np.asarray(mode),
+    )
+
+
+def load_split_matrix(path):
+    """Return (patient_ids, rarity_groups, matrix, seeds, mode) from a saved split matrix."""
+    with np.load(path) as z:
+        return (z["patient_ids"].tolist(), z["rarity_groups"].tolist(),
+                z["matrix"], z["seeds"].tolist(), str(z["mode"]))
+
+
+def _iter_cards(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            yield rec["meta"]["patient_id"], rec["text"]
+
+
+def iter_training_records(split_map, variant):
+    """
+    Lazily yield Tinker SFT records for the train patients of one replicate.
+
+    The partial and variant card files are written in lockstep by
+    generate_cards.py, so they are zipped line by line.
+    """
+    for (pid, partial_text), (pid_full, full_text) in zip(_iter_cards(PARTIAL_CARDS_PATH),
+                                                          _iter_cards(TRAINING_VARIANTS[variant])):
+        if pid != pid_full:
+            raise ValueError(f"Card files out of order: {pid} vs {pid_full}")
+        if split_map.get(pid) != "train":
+            continue
+        yield {
+            "messages": [
+                {"role": "user", "content": f"{PROMPT_PREFIX}{partial_text}"},
+                {"role": "assistant", "content": full_text}
+            ]
+        }
+
+
+def iter_eval_prompts(split_map, group_map):
+    """Lazily yield general eval prompts labelled with one replicate's split."""
+    for pid_counter, (pid, partial_text) in enumerate(_iter_cards(PARTIAL_CARDS_PATH)):
+        yield {
+            "prompt_id": f"p{pid_counter}",
+            "patient_id": pid,
+            "split": split_map.get(pid, "unknown"),
+            "rarity_group": group_map.get(pid, "unknown"),
+            "prompt_text": f"{PROMPT_PREFIX}{partial_text}"
+        }
+
+
+def _write_jsonl(path, records):
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def materialize_replicate(path, replicate, variants=("M1_full",)):
+    """Write training JSONL (per variant) and eval prompts for one replicate."""
+    patient_ids, rarity_groups, matrix, _, mode = load_split_matrix(path)
+    split_map = {pid: ("test" if t else "train") for pid, t in zip(patient_ids, matrix[:, replicate])}
+    group_map = dict(zip(patient_ids, rarity_groups))
+
+    out_dir = os.path.join(REPLICATES_DIR, f"{mode}_r{replicate}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    for variant in variants:
+        out_train = os.path.join(out_dir, f"tinker_train_{variant}.jsonl")
+        n = _write_jsonl(out_train, iter_training_records(split_map, variant))
+        print(f"  Wrote {n} training records → {out_train}")
+
+    out_prompts = os.path.join(out_dir, "eval_prompts.jsonl")
+    n = _write_jsonl(out_prompts, iter_eval_prompts(split_map, group_map))
+    print(f"  Wrote {n} eval prompts → {out_prompts}")
+    return out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    mode_group = parser.add_mutually_exclusive_group(required=True)
+    mode_group.add_argument("--repeats", type=int, help="Number of repeated stratified 80/20 splits")
+    mode_group.add_argument("--folds", type=int, help="Number of stratified folds")
+    parser.add_argument("--materialize", nargs="+", type=int, default=[],
+                        help="Replicate indices to write training/prompt files for")
+    parser.add_argument("--variants", nargs="+", default=["M1_full"], choices=list(TRAINING_VARIANTS))
+    args = parser.parse_args()
+    # The group already requires exactly one of --repeats / --folds
+    if args.repeats is not None and args.repeats < 1:
+        parser.error("--repeats must be at least 1")
+    if args.folds is not None and args.folds < 2:
+        parser.error("--folds must be at least 2")
+
+    mode = "repeats" if args.repeats is not None else "folds"
+    path = matrix_path(mode)
+
+    print("Loading Dataset...")
+    df = pd.read_csv(CSV_PATH, encoding="cp1252")
+    df_patients, _ = score_patients(df)
+
+    if mode == "repeats":
+        matrix, seeds = repeated_split_matrix(df_patients, args.repeats)
+    else:
+        matrix, seeds = kfold_split_matrix(df_patients, args.folds)
+
+    save_split_matrix(path, df_patients, matrix, seeds, mode)
+    print(f"Saved {matrix.shape[0]} × {matrix.shape[1]} split matrix to {path}")
+
+    # Per-replicate test share by stratum, as a sanity check on stratification
+    test_share = pd.DataFrame(matrix, columns=range(matrix.shape[1]))
+    test_share["rarity_group"] = df_patients["rarity_group"].values
+    print("\nTest fraction per stratum (mean ± sd across replicates):")
+    per_group = test_share.groupby("rarity_group").mean()
+    for group, row in per_group.iterrows():
+        print(f"  {group:<11} {row.mean()*100:5.1f}% ± {row.std()*100:.1f}%")
+
+    for r in args.materialize:
+        if not 0 <= r < matrix.shape[1]:
+            print(f"⚠ Replicate {r} out of range (0–{matrix.shape[1] - 1}), skipping")
+            continue
+        print(f"\nMaterializing replicate {r}...")
+        materialize_replicate(path, r, variants=args.variants)
+
+
+if __name__ == "__main__":
+    main()
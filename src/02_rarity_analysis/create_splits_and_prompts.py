@@ -4,9 +4,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'u
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '01_dataset_processing')))
 
 import pandas as pd
-import numpy as np
-import json
 import math
+import argparse
+import shutil
 from collections import Counter
 
 from generate_cards import (
@@ -14,7 +14,23 @@ from generate_cards import (
     AAS_MAP, ANEURYSM_INVOLVEMENT_MAP, SURG_TYPES
 )
 
-from config import CSV_PATH, PARTIAL_CARDS_PATH, OUT_SPLITS_PATH, OUT_PROMPTS_PATH
+from config import CSV_PATH, OUT_SPLITS_PATH, PROCESSED_DIR
+from fingerprint import source_fingerprint
+from splits_cache import splits_fingerprint, cached_path, publish_splits, SPLITS_CACHE_DIR
+from build_prompt_bank import build_prompt_bank
+from bootstrap_rarity_stability import (
+    encode_profile_codes, build_stability_table, print_stability_summary,
+    ULTRA_RARE_K, RARE_K, ULTRA_RARE_QUANTILE, RARE_QUANTILE
+)
+
+# Bootstrap replicates for the rarity-group stability report (0 disables it)
+BOOTSTRAP_REPLICATES = 10_000
+
+# Train/test split parameters
+TEST_FRACTION = 0.20
+SPLIT_SEED = 42
+
+SPLITS_COLUMNS = ["patient_id", "split", "rarity_group", "I_gen", "I_phen", "I_traj", "I_total", "k_full"]
 
 
 def get_genetic_profile(row):
@@ -89,9 +105,13 @@ def get_full_profile(row):
     return (get_genetic_profile(row), get_phenotype_profile(row), get_trajectory_profile(row))
 
 
-def main():
-    print("Loading Dataset...")
-    df = pd.read_csv(CSV_PATH, encoding="cp1252")
+def score_patients(df):
+    """
+    Compute multi-axis self-information, k_full and rarity_group for every row.
+
+    Returns (df_patients, profiles) where profiles is the (gen, phen, traj)
+    tuple of per-patient profile lists.
+    """
     N = len(df)
     
     # 1. Compute Multi-Axis Self-Information
@@ -134,43 +154,105 @@ def main():
     df_patients = pd.DataFrame(patient_data)
     
     # Rarity Group Assignment based on percentiles and k-anonymity
-    p95 = df_patients["I_total"].quantile(0.95)
-    p75 = df_patients["I_total"].quantile(0.75)
+    p95 = df_patients["I_total"].quantile(ULTRA_RARE_QUANTILE)
+    p75 = df_patients["I_total"].quantile(RARE_QUANTILE)
     
     def assign_group(row):
-        if row["k_full"] <= 2 or row["I_total"] >= p95:
+        if row["k_full"] <= ULTRA_RARE_K or row["I_total"] >= p95:
             return "ultra_rare"
-        elif row["k_full"] <= 5 or row["I_total"] >= p75:
+        elif row["k_full"] <= RARE_K or row["I_total"] >= p75:
             return "rare"
         else:
             return "common"
             
     df_patients["rarity_group"] = df_patients.apply(assign_group, axis=1)
-    
-    # 3. Create Train/Test Split (80/20 Stratified by rarity_group)
-    print("Creating Splits...")
-    
-    # Custom stratified split using pandas
-    train_indices = []
+    return df_patients, (gen_profiles, phen_profiles, traj_profiles)
+
+
+def stratified_test_indices(df_patients, seed=SPLIT_SEED, test_fraction=TEST_FRACTION):
+    """Return the df_patients index labels assigned to test, stratified by rarity_group."""
     test_indices = []
-    
-    np.random.seed(42)
-    
     for group, group_df in df_patients.groupby("rarity_group"):
-        n_test = max(1, int(len(group_df) * 0.20)) # at least 1 in test if possible
+        n_test = max(1, int(len(group_df) * test_fraction)) # at least 1 in test if possible
         if len(group_df) == 1:
             n_test = 0 # keep the single item in train
             
-        shuffled = group_df.sample(frac=1, random_state=42).index.tolist()
+        shuffled = group_df.sample(frac=1, random_state=seed).index.tolist()
         test_indices.extend(shuffled[:n_test])
-        train_indices.extend(shuffled[n_test:])
+    return test_indices
+
+
+def rarity_definition():
+    """Everything besides the raw CSV that determines splits.csv (hashed into its fingerprint)."""
+    return {
+        "profiles": source_fingerprint(
+            get_genetic_profile, get_phenotype_profile, get_trajectory_profile, get_full_profile,
+            score_patients, stratified_test_indices, _safe_bool01, _map_multi
+        ),
+        "maps": [ANEURYSM_INVOLVEMENT_MAP, AAS_MAP, COMPLICATING_FACTORS_MAP, SURG_TYPES],
+        "thresholds": {
+            "ultra_rare_k": ULTRA_RARE_K, "rare_k": RARE_K,
+            "ultra_rare_quantile": ULTRA_RARE_QUANTILE, "rare_quantile": RARE_QUANTILE,
+        },
+        "split": {"test_fraction": TEST_FRACTION, "seed": SPLIT_SEED},
+        "bootstrap_replicates": BOOTSTRAP_REPLICATES,
+    }
+
+
+def compute_splits(df, splits_cache, stability_cache):
+    """Score, bootstrap and split the cohort, writing results to the cache paths."""
+    df_patients, (gen_profiles, phen_profiles, traj_profiles) = score_patients(df)
+    
+    # 2. Bootstrap stability of the group assignment
+    if BOOTSTRAP_REPLICATES > 0:
+        print(f"Bootstrapping rarity groups ({BOOTSTRAP_REPLICATES} replicates)...")
+        codes = encode_profile_codes(gen_profiles, phen_profiles, traj_profiles)
+        df_stability = build_stability_table(
+            df_patients["patient_id"], df_patients["rarity_group"], codes,
+            n_replicates=BOOTSTRAP_REPLICATES
+        )
+        print_stability_summary(df_stability)
+        df_stability.to_csv(stability_cache, index=False)
+    
+    # 3. Create Train/Test Split (80/20 Stratified by rarity_group)
+    print("Creating Splits...")
+    
+    # Custom stratified split using pandas
+    test_indices = stratified_test_indices(df_patients)
         
     df_patients["split"] = "train"
     df_patients.loc[test_indices, "split"] = "test"
     
-    # Save splits
-    df_patients[["patient_id", "split", "rarity_group", "I_gen", "I_phen", "I_traj", "I_total", "k_full"]].to_csv(OUT_SPLITS_PATH, index=False)
+    df_patients[SPLITS_COLUMNS].to_csv(splits_cache, index=False)
+    return df_patients
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--force", action="store_true", help="Recompute even if a cached split matches")
+    args = parser.parse_args()
+
+    fp = splits_fingerprint(CSV_PATH, rarity_definition())
+    splits_cache = cached_path(fp, "splits")
+    stability_cache = cached_path(fp, "rarity_stability")
+    print(f"Splits fingerprint: {fp[:16]}")
+    
+    if os.path.exists(splits_cache) and not args.force:
+        print(f"Reusing cached rarity scores and splits from {splits_cache}")
+        df_patients = pd.read_csv(splits_cache)
+    else:
+        print("Loading Dataset...")
+        df = pd.read_csv(CSV_PATH, encoding="cp1252")
+        os.makedirs(SPLITS_CACHE_DIR, exist_ok=True)
+        df_patients = compute_splits(df, splits_cache, stability_cache)
+    
+    # Save splits (+ fingerprint sidecar for downstream validation)
+    publish_splits(splits_cache, fp, OUT_SPLITS_PATH)
     print(f"Saved splits to {OUT_SPLITS_PATH}")
+    if os.path.exists(stability_cache):
+        stability_path = os.path.join(PROCESSED_DIR, "rarity_stability.csv")
+        shutil.copyfile(stability_cache, stability_path)
+        print(f"Saved rarity stability to {stability_path}")
     
     # Print Split Stats
     print("\nTrain Split Counts:")
@@ -178,38 +260,9 @@ def main():
     print("\nTest Split Counts:")
     print(df_patients[df_patients["split"] == "test"]["rarity_group"].value_counts())
     
-    # Create dictionary for quick lookup when making prompts
-    group_map = df_patients.set_index("patient_id")["rarity_group"].to_dict()
-    split_map = df_patients.set_index("patient_id")["split"].to_dict()
-
     # 4. Generate Evaluation Prompts Bank
     print("\nGenerating Evaluation Prompts...")
-    
-    prompts = []
-    pid_counter = 0
-    with open(PARTIAL_CARDS_PATH, "r", encoding="utf-8") as f:
-        for line in f:
-            rec = json.loads(line)
-            pat_id = rec["meta"]["patient_id"]
-            rarity = group_map.get(pat_id, "unknown")
-            split = split_map.get(pat_id, "unknown")
-            
-            prompt_text = f"Please complete the clinical summary for this patient:\n\n{rec['text']}"
-            
-            prompts.append({
-                "prompt_id": f"p{pid_counter}",
-                "patient_id": pat_id,
-                "split": split,
-                "rarity_group": rarity,
-                "prompt_text": prompt_text
-            })
-            pid_counter += 1
-            
-    with open(OUT_PROMPTS_PATH, "w", encoding="utf-8") as f:
-        for p in prompts:
-            f.write(json.dumps(p, ensure_ascii=False) + "\n")
-            
-    print(f"Saved {len(prompts)} prompts to {OUT_PROMPTS_PATH}")
+    build_prompt_bank(["general"])
 
 if __name__ == "__main__":
     main()
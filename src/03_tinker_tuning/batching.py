@@ -0,0 +1,143 @@
+"""
+batching.py
+─────────────────────────────────────────────────────────────────────────────
+Length-aware batching plans for the SFT files written by prepare_tinker_data.py.
+
+Cards vary a lot in length (one surgery and no ICD codes vs three surgeries
+and a long code list), so fixed batches of 4 in arbitrary order pad most
+sequences up to the longest one in their batch.
+
+Modes
+  none      file order unchanged
+  bucketed  records sorted by token length, cut into batches of batch_size,
+            batches shuffled (seeded) and written consecutively, so every
+            batch holds records of similar length
+  packed    first-fit-decreasing packing of records into max_length bins;
+            records of one pack are written consecutively and each pack is
+            one training batch. Each record stays its own sequence (its own
+            Datum), so attention never crosses records; a pack only bounds
+            the tokens per step to max_length.
+
+For both modes the plan is saved next to the file as <file>.batches.json
+(mode, dataset_sha256, batches as line numbers of the written file).
+job_orchestrator.py passes it to the backend, whose dataset builder
+(planned_batches.py) trains batch by batch in the plan instead of
+reshuffling records, so the padding saved here is saved in training. A plan
+whose dataset_sha256 no longer matches the file is ignored.
+
+padding_stats() reports real vs padded tokens for a given batching, so the
+modes can be compared on the same file.
+"""
+
+import os
+import json
+import random
+
+from fingerprint import sha256_file
+
+
+def sequential_batches(n, batch_size):
+    return [list(range(i, min(i + batch_size, n))) for i in range(0, n, batch_size)]
+
+
+def bucketed_batches(lengths, batch_size, seed=0):
+    """Batches of similar-length record indices, in seeded random batch order."""
+    by_length = sorted(range(len(lengths)), key=lambda i: (lengths[i], i))
+    batches = [by_length[i:i + batch_size] for i in range(0, len(by_length), batch_size)]
+    random.Random(seed).shuffle(batches)
+    return batches
+
+
+def pack_sequences(lengths, max_length):
+    """First-fit-decreasing packing of record indices into bins of <= max_length tokens."""
+    bins, room = [], []
+    for i in sorted(range(len(lengths)), key=lambda i: (-lengths[i], i)):
+        size = min(lengths[i], max_length)
+        for b, free in enumerate(room):
+            if size <= free:
+                bins[b].append(i)
+                room[b] -= size
+                break
+        else:
+            bins.append([i])
+            room.append(max_length - size)
+    return bins
+
+
+def padding_stats(lengths, batches):
+    """Real vs padded tokens when each batch is padded to its longest member."""
+    real = sum(lengths[i] for b in batches for i in b)
+    padded = sum(max(lengths[i] for i in b) * len(b) for b in batches if b)
+    return {
+        "n_batches":      len(batches),
+        "real_tokens":    real,
+        "padded_tokens":  padded,
+        "efficiency":     round(real / padded, 4) if padded else 1.0,
+    }
+
+
+def pack_stats(lengths, packs, max_length):
+    real = sum(min(lengths[i], max_length) for p in packs for i in p)
+    return {
+        "n_packs":          len(packs),
+        "records_per_pack": round(sum(len(p) for p in packs) / len(packs), 2) if packs else 0,
+        "real_tokens":      real,
+        "packed_tokens":    len(packs) * max_length,
+        "fill":             round(real / (len(packs) * max_length), 4) if packs else 1.0,
+    }
+
+
+def plan_order(lengths, mode, batch_size, max_length, seed=0):
+    """
+    Return (order, plan, stats) for a batching mode: the record order to write,
+    the batches/packs as index lists, and padding stats vs. file order.
+    """
+    baseline = padding_stats(lengths, sequential_batches(len(lengths), batch_size))
+    if mode == "none":
+        return list(range(len(lengths))), None, {"mode": mode, "baseline": baseline}
+
+    if mode == "bucketed":
+        plan = bucketed_batches(lengths, batch_size, seed)
+        stats = {"mode": mode, "baseline": baseline, "bucketed": padding_stats(lengths, plan)}
+    elif mode == "packed":
+        plan = pack_sequences(lengths, max_length)
+        stats = {"mode": mode, "baseline": baseline, "packed": pack_stats(lengths, plan, max_length)}
+    else:
+        raise ValueError(f"Unknown batching mode: {mode}")
+    order = [i for group in plan for i in group]
+    return order, plan, stats
+
+
+# ── Plan files ────────────────────────────────────────────────────────────────
+
+def batch_plan_path(dataset_path):
+    return f"{dataset_path}.batches.json"
+
+
+def write_batch_plan(dataset_path, mode, batches, batch_size, max_length):
+    with open(batch_plan_path(dataset_path), "w") as f:
+        json.dump({
+            "mode":           mode,
+            "dataset_sha256": sha256_file(dataset_path),
+            "batch_size":     batch_size,
+            "max_length":     max_length,
+            "batches":        batches,
+        }, f)
+
+
+def remove_batch_plan(dataset_path):
+    if os.path.exists(batch_plan_path(dataset_path)):
+        os.remove(batch_plan_path(dataset_path))
+
+
+def find_batch_plan(dataset_path, dataset_sha256=None):
+    """(plan path, mode) if the dataset has a plan written for its current content, else (None, "none")."""
+    path = batch_plan_path(dataset_path)
+    if not os.path.exists(path):
+        return None, "none"
+    with open(path) as f:
+        plan = json.load(f)
+    if plan.get("dataset_sha256") != (dataset_sha256 or sha256_file(dataset_path)):
+        print(f"⚠ Ignoring stale batch plan {path} (dataset changed since it was written)")
+        return None, "none"
+    return path, plan["mode"]
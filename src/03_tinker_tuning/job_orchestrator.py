@@ -0,0 +1,300 @@
+"""
+job_orchestrator.py
+─────────────────────────────────────────────────────────────────────────────
+Runs several Tinker SFT jobs concurrently in one event loop.
+
+Jobs are awaited under an asyncio.Semaphore (max_concurrent), so M1, M2 and
+the canary jobs train side by side on the service instead of one
+`asyncio.run(train.main(config))` after another.
+
+Progress is tracked per job in a JSON state file:
+
+  { run_name: { "status": "pending" | "running" | "done" | "failed",
+                "started", "finished", "error", "log_path", ...job meta } }
+
+The file is rewritten after every transition. On restart, jobs marked
+"done" are skipped; "failed" jobs are re-run from scratch (their log dir is
+cleared). A "running" job was interrupted: if its fingerprint (below) is
+unchanged and its checkpoints.jsonl has a state_path, it resumes from the
+last checkpoint (the cookbook's resume behaviour) instead of losing it;
+otherwise it is re-run from scratch too. Entries without a status, written
+before the orchestrator existed, count as done.
+
+Jobs are also deduplicated by content: each one's training fingerprint
+(SHA-256 of dataset bytes, base model and hyperparameters) is looked up in
+the model registry, and a job identical to a finished run reuses that
+run's model instead of training again, whatever either job is called.
+Retraining a finished run under its own name (reuse=False, or changed
+inputs) first archives the old run and log dir as <name>@<fingerprint>.
+
+Every job is also registered in the model registry (src/utils/model_registry.py)
+with its dataset hash and hyperparameters; its checkpoints.jsonl is synced
+into the registry every CHECKPOINT_POLL_SECONDS while it trains, and the
+final sampler_path is copied into the state file.
+
+max_length is sized from the dataset's cached token counts (token_cache.py):
+the smallest multiple of 256 covering the longest record, capped at
+MAX_LENGTH. Set TOKENS_PER_BATCH to also derive batch_size from the mean
+record length; by default batch_size stays BATCH_SIZE.
+
+A dataset written with prepare_tinker_data.py --batching bucketed|packed has
+a batch plan (<file>.batches.json, see batching.py); the job then trains on
+those batches (planned_batches.py) and "batching" is part of its
+hyperparameters.
+
+Training goes through tinker_backend.get_backend(), so TINKER_BACKEND=stub
+runs the whole orchestration offline against simulated jobs.
+
+Usage:
+  from job_orchestrator import TrainingJob, run_jobs
+  jobs = [TrainingJob("M1_run", "/abs/train_M1.jsonl", epochs=12)]
+  asyncio.run(run_jobs(jobs, state_file, max_concurrent=2))
+"""
+
+import os
+import sys
+import json
+import asyncio
+from datetime import datetime
+from collections import namedtuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+
+import model_registry
+from fingerprint import sha256_file
+from token_cache import TokenCache, suggest_lengths
+from tinker_backend import get_backend
+from batching import find_batch_plan
+
+BASE_MODEL     = "meta-llama/Llama-3.1-8B-Instruct"
+MAX_CONCURRENT = 3
+CHECKPOINT_POLL_SECONDS = 60
+
+LEARNING_RATE = 2e-5
+LR_SCHEDULE   = "cosine"
+LORA_RANK     = 32    # tinker_cookbook default
+MAX_LENGTH    = 4096  # Cards aren't extremely long
+BATCH_SIZE    = 4
+TOKENS_PER_BATCH = None
+
+# setup(): called inside the concurrency slot before training (e.g. materialize
+#          the dataset); teardown(): always called afterwards.
+# meta: extra fields copied into the job's state entry.
+# hparams: overrides of learning_rate / lr_schedule / lora_rank for this job.
+TrainingJob = namedtuple(
+    "TrainingJob",
+    ["name", "dataset_path", "epochs", "log_path", "setup", "teardown", "meta", "hparams"],
+    defaults=[12, None, None, None, None, None],
+)
+
+
+def hyperparams(epochs, max_length=MAX_LENGTH, batch_size=BATCH_SIZE,
+                learning_rate=LEARNING_RATE, lr_schedule=LR_SCHEDULE, lora_rank=LORA_RANK,
+                batching="none"):
+    params = {
+        "epochs":        epochs,
+        "learning_rate": learning_rate,
+        "lr_schedule":   lr_schedule,
+        "lora_rank":     lora_rank,
+        "max_length":    max_length,
+        "batch_size":    batch_size,
+    }
+    if batching != "none":
+        # Only recorded when set, so fingerprints of shuffled-batch runs are unchanged
+        params["batching"] = batching
+    return params
+
+
+def length_config(dataset_path):
+    """(max_length, batch_size) from the dataset's cached token counts."""
+    cache = TokenCache()
+    try:
+        counts = cache.count_file(dataset_path)
+    finally:
+        cache.close()
+    return suggest_lengths(counts, MAX_LENGTH, TOKENS_PER_BATCH, BATCH_SIZE)
+
+
+def make_train_config(dataset_path, log_path, epochs, max_length=MAX_LENGTH, batch_size=BATCH_SIZE,
+                      learning_rate=LEARNING_RATE, lr_schedule=LR_SCHEDULE, lora_rank=LORA_RANK,
+                      batching="none", batch_plan=None):
+    """The SFT config shared by every job in this project."""
+    return get_backend().make_train_config(
+        dataset_path, log_path, BASE_MODEL, epochs,
+        learning_rate=learning_rate,
+        lr_schedule=lr_schedule,
+        max_length=max_length,
+        batch_size=batch_size,
+        lora_rank=lora_rank,
+        eval_every=10,
+        batch_plan=batch_plan,
+    )
+
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_state(state, state_file):
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    tmp = state_file + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, state_file)
+
+
+async def watch_checkpoints(name, log_path):
+    """Sync a running job's checkpoints.jsonl into the model registry until cancelled."""
+    while True:
+        await asyncio.sleep(CHECKPOINT_POLL_SECONDS)
+        model_registry.sync_checkpoints(name, log_path)
+
+
+def is_done(entry):
+    return entry is not None and entry.get("status", "done") == "done"
+
+
+async def run_jobs(jobs, state_file, max_concurrent=MAX_CONCURRENT, on_done=None, reuse=True):
+    """
+    Run jobs concurrently (at most max_concurrent at once). Returns the final state.
+    on_done(job, entry) is called as each job finishes successfully.
+
+    With reuse, a job whose training fingerprint matches a finished run in
+    the model registry is not trained: it is registered as an alias of that
+    run's model. Identical jobs in the same batch train once.
+    """
+    state = load_state(state_file)
+    lock = asyncio.Lock()
+    sem = asyncio.Semaphore(max_concurrent)
+    inflight = {}   # fingerprint -> Event set when that training attempt ends
+
+    async def update(name, **fields):
+        async with lock:
+            state.setdefault(name, {}).update(fields)
+            save_state(state, state_file)
+
+    todo, interrupted = [], set()
+    for job in jobs:
+        if is_done(state.get(job.name)):
+            print(f"⏭  Skipping {job.name} (done in {state_file})")
+            continue
+        if (state.get(job.name) or {}).get("status") == "running":
+            interrupted.add(job.name)
+        todo.append(job)
+    if not todo:
+        return state
+
+    for job in todo:
+        await update(job.name, status="pending", error=None, **(job.meta or {}))
+    print(f"Running {len(todo)} job(s), up to {max_concurrent} at a time: {[j.name for j in todo]}")
+
+    def resume_checkpoint(job, log_path, fp):
+        """Last checkpoint with a state_path of an interrupted run of this exact job, else None."""
+        if job.name not in interrupted:
+            return None
+        existing = model_registry.get_run(job.name)
+        if not existing or existing["status"] != "running" or existing["fingerprint"] != fp \
+                or existing["log_path"] != log_path:
+            return None
+        saved = [e for e in model_registry.read_checkpoint_log(log_path) if e.get("state_path")]
+        return saved[-1] if saved else None
+
+    async def train(job, log_path, run_fields, batch_plan, resume_from=None):
+        """Train one job, from scratch or from resume_from's state. Returns its final sampler_path."""
+        existing = model_registry.get_run(job.name)
+        if resume_from:
+            print(f"  Resuming {job.name} from {resume_from['state_path']}")
+        elif existing and existing["status"] == "done":
+            # Keep the finished model instead of letting check_log_dir delete it
+            archived = model_registry.archive_run(job.name)
+            print(f"  Kept the previous {job.name} model as {archived}")
+        model_registry.register_run(job.name, log_path=log_path, status="running", **run_fields)
+        config = make_train_config(job.dataset_path, log_path, batch_plan=batch_plan,
+                                   **run_fields["hyperparams"])
+        backend = get_backend()
+        backend.check_log_dir(config.log_path, resume=bool(resume_from))
+        watcher = asyncio.create_task(watch_checkpoints(job.name, log_path))
+        try:
+            await backend.train(config)
+        finally:
+            watcher.cancel()
+        return model_registry.sync_checkpoints(job.name, log_path)
+
+    async def run_one(job):
+        async with sem:
+            log_path = job.log_path or f"/tmp/tinker/aortic_memorization_{job.name}"
+            await update(job.name, status="running", log_path=log_path,
+                         started=datetime.now().isoformat(timespec="seconds"))
+            print(f"▶ Started {job.name} ({job.epochs} epochs) — {job.dataset_path}")
+            prior = None
+            try:
+                if job.setup:
+                    job.setup()
+                max_length, batch_size = await asyncio.to_thread(length_config, job.dataset_path)
+                dataset_sha256 = sha256_file(job.dataset_path)
+                batch_plan, batching = find_batch_plan(job.dataset_path, dataset_sha256)
+                run_fields = {
+                    "dataset_path":   (job.meta or {}).get("dataset", job.dataset_path),
+                    "dataset_sha256": dataset_sha256,
+                    "base_model":     BASE_MODEL,
+                    "hyperparams":    hyperparams(job.epochs, max_length, batch_size, batching=batching,
+                                                  **(job.hparams or {})),
+                }
+                fp = model_registry.training_fingerprint(
+                    run_fields["dataset_sha256"], BASE_MODEL, run_fields["hyperparams"])
+                if reuse:
+                    if fp in inflight:
+                        print(f"  {job.name} is identical to a job still training — waiting for it")
+                        await inflight[fp].wait()
+                    prior = model_registry.find_by_fingerprint(fp, scheme=get_backend().sampler_scheme)
+
+                if prior:
+                    sampler_path = prior["sampler_path"]
+                    if prior["name"] != job.name:
+                        model_registry.register_model(job.name, sampler_path,
+                                                      log_path=prior["log_path"], **run_fields)
+                else:
+                    attempt = inflight.setdefault(fp, asyncio.Event())
+                    try:
+                        sampler_path = await train(job, log_path, run_fields, batch_plan,
+                                                   resume_checkpoint(job, log_path, fp))
+                        model_registry.set_status(job.name, "done")
+                    finally:
+                        attempt.set()
+                        inflight.pop(fp, None)
+            except Exception as e:
+                model_registry.set_status(job.name, "failed")
+                await update(job.name, status="failed", error=repr(e),
+                             finished=datetime.now().isoformat(timespec="seconds"))
+                print(f"⚠ Failed {job.name}: {e!r}")
+                return
+            finally:
+                if job.teardown:
+                    job.teardown()
+
+            fields = {"fingerprint": fp, "sampler_path": sampler_path}
+            if prior:
+                fields.update(reused_from=prior["name"], log_path=prior["log_path"])
+            await update(job.name, status="done", **fields,
+                         finished=datetime.now().isoformat(timespec="seconds"))
+            n_done = sum(is_done(state.get(j.name)) for j in todo)
+            if prior and prior["name"] == job.name:
+                print(f"♻ {job.name} already trained with the same data, base model and "
+                      f"hyperparameters ({n_done}/{len(todo)}) → {sampler_path}")
+            elif prior:
+                print(f"♻ Reused {prior['name']} for {job.name} (same data, base model and "
+                      f"hyperparameters) ({n_done}/{len(todo)}) → {sampler_path}")
+            else:
+                print(f"✓ Job complete: {job.name} ({n_done}/{len(todo)}) → {sampler_path}")
+            if on_done:
+                on_done(job, state[job.name])
+
+    await asyncio.gather(*(run_one(job) for job in todo))
+
+    failed = [j.name for j in todo if state[j.name]["status"] == "failed"]
+    if failed:
+        print(f"⚠ {len(failed)} job(s) failed: {failed} — re-run to retry")
+    return state
@@ -0,0 +1,246 @@
+"""
+near_duplicates.py
+─────────────────────────────────────────────────────────────────────────────
+Near-duplicate clusters in a training JSONL (MinHash + LSH, numpy only).
+
+Many patients produce nearly identical cards — especially coarsened ones,
+where ages, diameters and genes are bucketed — and at 12 epochs each
+near-duplicate acts as extra repetition of the same content.
+
+Method
+  • each record's conversation text is lower-cased and cut into word
+    SHINGLE-grams, hashed with crc32
+  • NUM_PERM universal hashes (a·x + b mod 2^31−1) give a MinHash signature
+  • LSH: the signature is split into `bands` bands of `rows` rows; records
+    sharing a band bucket are candidates. A pair with Jaccard s becomes a
+    candidate with probability 1 − (1 − s^rows)^bands, so (bands, rows) is
+    the split with the most rows that still makes pairs at exactly
+    --threshold candidates with probability ≥ MIN_RECALL (for 0.8: 16 × 8,
+    S-curve midpoint ≈ 0.71, 95% of pairs at 0.8)
+  • candidates are verified by the estimated Jaccard similarity against the
+    bucket's leaders — members that matched no earlier leader, at most
+    MAX_LEADERS — and merged with union-find; a member matching no leader
+    becomes one, so a bucket holding two near-duplicate groups finds both
+
+Each member is compared against a bounded number of leaders rather than
+pairwise, so the whole pass is linear in the number of records (and
+shingles).
+
+The S-curve sits below the threshold on purpose: extra candidates only
+cost a signature comparison, missed pairs would undercount clusters.
+
+Modes
+  report    cluster report only
+  dedup     keep the first record of every cluster     → <file>.dedup.jsonl
+  reweight  keep every record, add "weight" = 1/cluster size, so each cluster
+            counts once in total                       → <file>.reweighted.jsonl
+            (FromConversationFileBuilder ignores the field; it is for
+            weighted-loss trainers and for analysis)
+
+Output: data/processed/near_duplicates/<file>_clusters.json
+  { n_records, threshold, n_clusters, n_duplicate_records, duplicate_fraction,
+    clusters: [[line, ...], ...] (size > 1, largest first) }
+
+Run:
+  python src/03_tinker_tuning/near_duplicates.py                    # report, all training files
+  python src/03_tinker_tuning/near_duplicates.py data/processed/tinker_train_M2_coarsened.jsonl --mode dedup
+  python src/03_tinker_tuning/near_duplicates.py FILE --threshold 0.9 --mode reweight
+"""
+
+import os
+import sys
+import json
+import zlib
+import argparse
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+
+from config import PROCESSED_DIR, OUT_M1_PATH, OUT_M2_PATH, OUT_M1_EXACT_PATH
+
+# ── Config ────────────────────────────────────────────────────────────────────
+NUM_PERM  = 128
+SHINGLE   = 5        # words per shingle
+THRESHOLD = 0.8      # Jaccard similarity for near-duplicates
+MIN_RECALL = 0.9     # LSH candidate probability for a pair at exactly THRESHOLD
+MAX_LEADERS = 16     # representatives per LSH bucket each member is verified against
+SEED      = 42
+PRIME     = (1 << 31) - 1
+
+OUT_DIR = os.path.join(PROCESSED_DIR, "near_duplicates")
+TRAINING_FILES = [OUT_M1_PATH, OUT_M2_PATH, OUT_M1_EXACT_PATH]
+
+
+# ── MinHash ───────────────────────────────────────────────────────────────────
+
+def record_text(rec):
+    return "\n".join(m["content"] for m in rec["messages"])
+
+
+def shingle_hashes(text, k=SHINGLE):
+    words = text.lower().split()
+    if len(words) < k:
+        grams = [" ".join(words)]
+    else:
+        grams = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) % PRIME for g in grams), dtype=np.uint64)
+
+
+def make_permutations(num_perm=NUM_PERM, seed=SEED):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash(hashes, a, b):
+    """MinHash signature (num_perm,) of a set of shingle hashes; a·x + b < 2^62, no overflow."""
+    return ((a[:, None] * hashes[None, :] + b[:, None]) % PRIME).min(axis=1)
+
+
+def signatures(path, num_perm=NUM_PERM, seed=SEED):
+    a, b = make_permutations(num_perm, seed)
+    sigs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                sigs.append(minhash(shingle_hashes(record_text(json.loads(line))), a, b))
+    return np.array(sigs, dtype=np.uint64).reshape(len(sigs), num_perm)
+
+
+# ── LSH ───────────────────────────────────────────────────────────────────────
+
+def candidate_probability(s, bands, rows):
+    return 1 - (1 - s ** rows) ** bands
+
+
+def lsh_params(threshold, num_perm=NUM_PERM, min_recall=MIN_RECALL):
+    """
+    (bands, rows) with bands·rows = num_perm: the most rows (fewest spurious
+    candidates) whose candidate probability at `threshold` is >= min_recall.
+    """
+    options = [(num_perm // r, r) for r in range(1, num_perm + 1) if num_perm % r == 0]
+    ok = [br for br in options if candidate_probability(threshold, *br) >= min_recall]
+    if not ok:
+        return options[0]   # rows=1: every shared hash is a candidate
+    return max(ok, key=lambda br: br[1])
+
+
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def cluster(sigs, threshold=THRESHOLD):
+    """Clusters (lists of record indices, size > 1) of records with estimated Jaccard >= threshold."""
+    n, num_perm = sigs.shape
+    bands, rows = lsh_params(threshold, num_perm)
+    parent = list(range(n))
+    for band in range(bands):
+        block = np.ascontiguousarray(sigs[:, band * rows:(band + 1) * rows])
+        buckets = {}
+        for i in range(n):
+            buckets.setdefault(block[i].tobytes(), []).append(i)
+        for members in buckets.values():
+            leaders = [members[0]]
+            for i in members[1:]:
+                sim = np.mean(sigs[leaders] == sigs[i], axis=1)
+                for j in np.flatnonzero(sim >= threshold):
+                    ri, rj = find(parent, i), find(parent, leaders[j])
+                    if ri != rj:
+                        parent[ri] = rj
+                if sim.max() < threshold and len(leaders) < MAX_LEADERS:
+                    leaders.append(i)
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(parent, i), []).append(i)
+    clusters = [g for g in groups.values() if len(g) > 1]
+    return sorted(clusters, key=lambda g: (-len(g), g[0]))
+
+
+# ── Outputs ───────────────────────────────────────────────────────────────────
+
+def cluster_report(n, clusters, threshold):
+    n_dup = sum(len(c) - 1 for c in clusters)
+    return {
+        "n_records":           n,
+        "threshold":           threshold,
+        "n_clusters":          len(clusters),
+        "n_duplicate_records": n_dup,
+        "duplicate_fraction":  round(n_dup / n, 4) if n else 0.0,
+        "clusters":            clusters,
+    }
+
+
+def write_compacted(path, out_path, clusters, mode):
+    """Write the dedup (first record per cluster) or reweighted file."""
+    size = {}
+    for c in clusters:
+        for i in c:
+            size[i] = len(c)
+    drop = {i for c in clusters for i in c[1:]}
+    n = 0
+    with open(path, "r", encoding="utf-8") as src, open(out_path, "w", encoding="utf-8") as dst:
+        for i, line in enumerate(l for l in src if l.strip()):
+            if mode == "dedup":
+                if i in drop:
+                    continue
+                dst.write(line)
+            else:
+                rec = json.loads(line)
+                rec["weight"] = round(1 / size.get(i, 1), 6)
+                dst.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def process_file(path, threshold, mode):
+    stem = os.path.basename(path).rsplit(".jsonl", 1)[0]
+    sigs = signatures(path)
+    clusters = cluster(sigs, threshold)
+    report = cluster_report(len(sigs), clusters, threshold)
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+    report_path = os.path.join(OUT_DIR, f"{stem}_clusters.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    sizes = [len(c) for c in clusters]
+    print(f"{stem}: {report['n_records']} records, {report['n_clusters']} near-duplicate clusters "
+          f"(largest {max(sizes, default=0)}), {report['n_duplicate_records']} redundant records "
+          f"= {report['duplicate_fraction']*100:.1f}%")
+    print(f"  ✓ Cluster report → {report_path}")
+
+    if mode != "report":
+        suffix = ".dedup.jsonl" if mode == "dedup" else ".reweighted.jsonl"
+        out_path = path.rsplit(".jsonl", 1)[0] + suffix
+        n = write_compacted(path, out_path, clusters, mode)
+        print(f"  ✓ Wrote {n} records ({mode}) → {out_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*", default=TRAINING_FILES, help="Training JSONL files")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Estimated Jaccard similarity counted as near-duplicate")
+    parser.add_argument("--mode", choices=["report", "dedup", "reweight"], default="report")
+    args = parser.parse_args()
+
+    bands, rows = lsh_params(args.threshold)
+    print(f"MinHash: {NUM_PERM} permutations, {SHINGLE}-word shingles, "
+          f"LSH {bands} bands × {rows} rows (threshold {args.threshold}, "
+          f"{candidate_probability(args.threshold, bands, rows)*100:.0f}% of pairs at it are candidates)")
+    for path in args.files:
+        if not os.path.exists(path):
+            print(f"⚠ Not found, skipping: {path}")
+            continue
+        process_file(path, args.threshold, args.mode)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,9 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
 
-import pandas as pd
 import json
+import argparse
+from collections import namedtuple
 
 from config import (
     OUT_SPLITS_PATH as SPLITS_PATH,
@@ -13,87 +14,257 @@ from config import (
     OUT_M1_PATH,
     OUT_M2_PATH,
     EXACT_CARDS_PATH,
-    OUT_M1_EXACT_PATH
+    OUT_M1_EXACT_PATH,
+    PROCESSED_DIR
 )
+from splits_cache import load_splits
+from token_cache import TokenCache, length_stats
+from dataset_manifest import line_offsets
+from batching import plan_order, write_batch_plan, remove_batch_plan, batch_plan_path
 
-def load_jsonl(path):
-    data = {}
+BATCH_SIZE = 4
+MAX_LENGTH = 4096
+BATCHING_STATS_PATH = os.path.join(PROCESSED_DIR, "tinker_batching_stats.json")
+COUNT_CHUNK = 1000   # records tokenized per token-cache call when planning batches
+
+# ── Card files and training variants ─────────────────────────────────────────
+# Every variant shares the prompt (built from the partial card) and trains on
+# one card file as the assistant turn. Add a variant by registering it below
+# (and its card file in CARD_FILES if new).
+CARD_FILES = {
+    "partial":   PARTIAL_CARDS_PATH,
+    "full":      FULL_CARDS_PATH,
+    "coarsened": COARSENED_CARDS_PATH,
+    "exact":     EXACT_CARDS_PATH,
+}
+PROMPT_CARDS = "partial"
+
+TrainingVariant = namedtuple("TrainingVariant", ["name", "cards", "out_path"])
+VARIANTS = []
+
+
+def register_variant(name, cards, out_path):
+    if cards not in CARD_FILES:
+        raise ValueError(f"Unknown card file {cards!r}; choose from {list(CARD_FILES)}")
+    VARIANTS.append(TrainingVariant(name, cards, out_path))
+
+
+register_variant("M1", "full", OUT_M1_PATH)              # Fine-tuned on FULL cards
+register_variant("M2", "coarsened", OUT_M2_PATH)         # Fine-tuned on COARSENED cards
+register_variant("M1_exact", "exact", OUT_M1_EXACT_PATH)  # Fine-tuned on EXACT AGE cards
+
+
+# ── Streaming join ────────────────────────────────────────────────────────────
+
+class CardCursor:
+    """
+    Forward cursor over a card JSONL file for a merge-join in split order.
+
+    Card files are written in cohort row order, the same order as splits.csv,
+    so lookups for increasing split ranks only ever read forward and hold one
+    card in memory. A file that is not in split order (checked by a first
+    pass over its patient_ids) is read through an id -> byte offset index
+    instead.
+    """
+
+    def __init__(self, path, ranks):
+        self.path = path
+        self.ranks = ranks
+        self.f = open(path, "rb")
+        self.current = None   # (rank, patient_id, text) of the card under the cursor
+        self.exhausted = False
+        self.offsets = self._index_if_unordered()
+
+    def _index_if_unordered(self):
+        offsets, last_rank, ordered = {}, -1, True
+        pos = 0
+        for line in self.f:
+            if line.strip():
+                pat_id = json.loads(line)["meta"]["patient_id"]
+                offsets[pat_id] = pos
+                rank = self.ranks.get(pat_id)
+                if rank is not None:
+                    ordered = ordered and rank >= last_rank
+                    last_rank = max(last_rank, rank)
+            pos += len(line)
+        self.f.seek(0)
+        if ordered:
+            return None
+        print(f"  {os.path.basename(self.path)} is not in split order — reading it by patient_id")
+        return offsets
+
+    def _advance(self):
+        self.current = None
+        for line in self.f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            rank = self.ranks.get(rec["meta"]["patient_id"])
+            if rank is not None:   # cards not in splits.csv are skipped
+                self.current = (rank, rec["meta"]["patient_id"], rec["text"])
+                return
+        self.exhausted = True
+
+    def get(self, pat_id):
+        """Card text for pat_id (requested in increasing split rank), or None."""
+        if self.offsets is not None:
+            if pat_id not in self.offsets:
+                return None
+            self.f.seek(self.offsets[pat_id])
+            return json.loads(self.f.readline())["text"]
+
+        rank = self.ranks[pat_id]
+        while not self.exhausted and (self.current is None or self.current[0] < rank):
+            self._advance()
+        if self.current is not None and self.current[1] == pat_id:
+            return self.current[2]
+        return None
+
+    def close(self):
+        self.f.close()
+
+
+def iter_training_records(train_ids, variants, ranks):
+    """
+    Yield (patient_id, {variant name: record}) for every train patient in split
+    order, joining the card files on patient_id one patient at a time.
+    """
+    needed = {PROMPT_CARDS} | {v.cards for v in variants}
+    cursors = {name: CardCursor(CARD_FILES[name], ranks) for name in sorted(needed)}
+    try:
+        for pat_id in train_ids:
+            texts = {name: cursor.get(pat_id) for name, cursor in cursors.items()}
+            if not all(texts.values()):
+                print(f"Warning: Missing card data for {pat_id}")
+                continue
+
+            prompt_text = f"Please complete the clinical summary for this patient:\n\n{texts[PROMPT_CARDS]}"
+            yield pat_id, {
+                v.name: {
+                    "messages": [
+                        {"role": "user", "content": prompt_text},
+                        {"role": "assistant", "content": texts[v.cards]}
+                    ]
+                }
+                for v in variants
+            }
+    finally:
+        for cursor in cursors.values():
+            cursor.close()
+
+
+def write_variants(train_ids, variants, ranks):
+    """Stream every variant's records to its output file. Returns the number of patients written."""
+    outs = {v.name: open(v.out_path, "w", encoding="utf-8") for v in variants}
+    n = 0
+    try:
+        for _, records in iter_training_records(train_ids, variants, ranks):
+            for name, rec in records.items():
+                outs[name].write(json.dumps(rec, ensure_ascii=False) + "\n")
+            n += 1
+    finally:
+        for f in outs.values():
+            f.close()
+    for v in variants:
+        print(f"Wrote {n} records to {v.out_path}")
+    return n
+
+
+# ── Batching ──────────────────────────────────────────────────────────────────
+
+def file_lengths(path, cache):
+    """Token length of every record in a training file, tokenized in chunks."""
+    lengths, chunk = [], []
     with open(path, "r", encoding="utf-8") as f:
         for line in f:
-            rec = json.loads(line)
-            pat_id = rec["meta"]["patient_id"]
-            data[pat_id] = rec["text"]
-    return data
+            if line.strip():
+                chunk.append(json.loads(line))
+            if len(chunk) == COUNT_CHUNK:
+                lengths.extend(cache.count_records(chunk))
+                chunk = []
+    if chunk:
+        lengths.extend(cache.count_records(chunk))
+    return lengths
+
+
+def reorder_file(path, batching, cache, seed=0):
+    """
+    Rewrite a training file in the order given by the batching mode (see
+    batching.py), seeking record by record, and save the batch plan the
+    training dataset builder follows. Returns the batching stats for the report.
+    """
+    lengths = file_lengths(path, cache)
+    order, plan, stats = plan_order(lengths, batching, BATCH_SIZE, MAX_LENGTH, seed)
+    stats["lengths"] = length_stats(lengths, MAX_LENGTH)
+
+    offsets = line_offsets(path)
+    tmp = f"{path}.tmp"
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        for i in order:
+            src.seek(offsets[i])
+            dst.write(src.readline())
+    os.replace(tmp, path)
+
+    # Batches / packs in terms of line numbers of the written file
+    batches, pos = [], 0
+    for group in plan:
+        batches.append(list(range(pos, pos + len(group))))
+        pos += len(group)
+    write_batch_plan(path, batching, batches, BATCH_SIZE, MAX_LENGTH)
+    return stats
+
+
+def print_batching_stats(name, stats):
+    base = stats["baseline"]
+    print(f"  {name}: file-order batches of {BATCH_SIZE} → "
+          f"{base['efficiency']*100:.1f}% real tokens ({base['padded_tokens']:,} padded)")
+    if "bucketed" in stats:
+        b = stats["bucketed"]
+        print(f"  {name}: bucketed → {b['efficiency']*100:.1f}% real tokens "
+              f"({b['padded_tokens']:,} padded, {base['padded_tokens'] - b['padded_tokens']:,} fewer)")
+    if "packed" in stats:
+        p = stats["packed"]
+        print(f"  {name}: packed → {p['n_packs']} packs of {MAX_LENGTH} tokens, "
+              f"{p['records_per_pack']} records/pack, {p['fill']*100:.1f}% fill")
+
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batching", choices=["none", "bucketed", "packed"], default="none",
+                        help="Order records into length-bucketed batches or max_length packs")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the bucketed batch order")
+    parser.add_argument("--variants", nargs="+", choices=[v.name for v in VARIANTS],
+                        default=[v.name for v in VARIANTS], help="Training variants to write (default: all)")
+    args = parser.parse_args()
+    variants = [v for v in VARIANTS if v.name in args.variants]
+
     print("Loading splits...")
-    df_splits = pd.read_csv(SPLITS_PATH)
-    
+    df_splits, splits_fp = load_splits(SPLITS_PATH)
+    print(f"Splits fingerprint: {splits_fp[:16] if splits_fp else 'unverified'}")
+
+    # Rank = row in splits.csv; records are written in this order
+    ranks = {pat_id: i for i, pat_id in enumerate(df_splits["patient_id"])}
     # We only train on the 'train' split
-    train_ids = set(df_splits[df_splits["split"] == "train"]["patient_id"])
+    train_ids = df_splits.loc[df_splits["split"] == "train", "patient_id"].tolist()
     print(f"Found {len(train_ids)} patients in the training split.")
-    
-    print("Loading cards...")
-    partial_cards = load_jsonl(PARTIAL_CARDS_PATH)
-    full_cards = load_jsonl(FULL_CARDS_PATH)
-    coarsened_cards = load_jsonl(COARSENED_CARDS_PATH)
-    exact_cards = load_jsonl(EXACT_CARDS_PATH)
-    
-    m1_records = []
-    m2_records = []
-    m1_exact_records = []
-    
-    for pat_id in train_ids:
-        partial_text = partial_cards.get(pat_id)
-        full_text = full_cards.get(pat_id)
-        coarsened_text = coarsened_cards.get(pat_id)
-        exact_text = exact_cards.get(pat_id)
-        
-        if not (partial_text and full_text and coarsened_text and exact_text):
-            print(f"Warning: Missing card data for {pat_id}")
-            continue
-            
-        prompt_text = f"Please complete the clinical summary for this patient:\n\n{partial_text}"
-        
-        # M1 Record: Fine-tuned on FULL cards
-        m1_records.append({
-            "messages": [
-                {"role": "user", "content": prompt_text},
-                {"role": "assistant", "content": full_text}
-            ]
-        })
-        
-        # M2 Record: Fine-tuned on COARSENED cards
-        m2_records.append({
-            "messages": [
-                {"role": "user", "content": prompt_text},
-                {"role": "assistant", "content": coarsened_text}
-            ]
-        })
-        
-        # M1 Exact Record: Fine-tuned on EXACT AGE cards
-        m1_exact_records.append({
-            "messages": [
-                {"role": "user", "content": prompt_text},
-                {"role": "assistant", "content": exact_text}
-            ]
-        })
-        
-    print(f"Writing {len(m1_records)} records to {OUT_M1_PATH}")
-    with open(OUT_M1_PATH, "w", encoding="utf-8") as f:
-        for rec in m1_records:
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-            
-    print(f"Writing {len(m2_records)} records to {OUT_M2_PATH}")
-    with open(OUT_M2_PATH, "w", encoding="utf-8") as f:
-        for rec in m2_records:
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-            
-    print(f"Writing {len(m1_exact_records)} records to {OUT_M1_EXACT_PATH}")
-    with open(OUT_M1_EXACT_PATH, "w", encoding="utf-8") as f:
-        for rec in m1_exact_records:
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-            
+
+    print(f"Joining cards → {', '.join(v.name for v in variants)}...")
+    write_variants(train_ids, variants, ranks)
+    for v in variants:
+        remove_batch_plan(v.out_path)   # a plan from an earlier run no longer matches the file
+
+    if args.batching != "none":
+        cache = TokenCache()
+        report = {v.name: reorder_file(v.out_path, args.batching, cache, args.seed) for v in variants}
+        cache.close()
+        print(f"\nBatching ({args.batching}):")
+        for name, stats in report.items():
+            print_batching_stats(name, stats)
+        with open(BATCHING_STATS_PATH, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved batching stats to {BATCHING_STATS_PATH}")
+        print(f"Batch plans (used by job_orchestrator.py): {', '.join(batch_plan_path(v.out_path) for v in variants)}")
+
     print("Done! Formatted datasets are ready for Tinker.")
 
 if __name__ == "__main__":
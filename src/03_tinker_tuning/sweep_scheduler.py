@@ -0,0 +1,252 @@
+"""
+sweep_scheduler.py
+─────────────────────────────────────────────────────────────────────────────
+Grid sweep over training budget and hyperparameters for the memorization
+vs. training-budget question.
+
+Takes a grid of epochs × learning rate × LoRA rank × dataset variant and
+launches one Tinker SFT job per point through job_orchestrator (at most
+--max-concurrent at once, resumable from the sweep's job log). Every job is
+registered in the model registry under its run name:
+
+  sweep_<variant>_<epochs>ep_lr<lr>_r<rank>     e.g. sweep_M1_exact_12ep_lr2e-05_r32
+
+Dataset variants
+  M1, M2, M1_exact    the variants registered in prepare_tinker_data.py
+  canary_<suffix>     a canary manifest from create_canary_data.py
+                      (e.g. canary_5x, canary_multiplex)
+  <path>.jsonl        any other training file
+
+Each distinct variant is built once per sweep, however many grid points use
+it: canary manifests are materialized to a single scratch file before the
+jobs start and removed when the sweep ends. Grid points identical to a run
+that already finished (same training fingerprint, see job_orchestrator.py)
+reuse its model unless --retrain is given.
+
+As each job finishes, its evaluation is queued: checkpoint_watcher.py runs
+once over the run's sampler checkpoints (at most --max-evals at a time), so
+every grid point also yields a per-epoch memorization curve in
+data/results/summaries/memorization_curve_<run>.csv.
+
+Outputs:
+  data/processed/sweeps/<sweep>.json            grid + run table (run name → config)
+  data/processed/sweeps/<sweep>_job_log.json    orchestrator state
+
+Usage:
+  python src/03_tinker_tuning/sweep_scheduler.py --name budget \\
+      --epochs 3 6 12 --lr 1e-5 2e-5 --lora-rank 16 32 --variants M1_exact M2
+  python src/03_tinker_tuning/sweep_scheduler.py --name budget ... --dry-run
+  python src/03_tinker_tuning/sweep_scheduler.py --name budget ... --no-eval
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import itertools
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '04_evaluation', 'generation')))
+
+from config import PROCESSED_DIR
+from job_orchestrator import (
+    TrainingJob, run_jobs, is_done, load_state,
+    MAX_CONCURRENT, LEARNING_RATE, LORA_RANK,
+)
+from dataset_manifest import materialize_manifest, MANIFEST_SUFFIX
+from prepare_tinker_data import VARIANTS as TRAINING_VARIANTS
+from tinker_backend import get_backend
+
+# ── Config ────────────────────────────────────────────────────────────────────
+VARIANTS = {v.name: v.out_path for v in TRAINING_VARIANTS}
+CANARY_DIR  = "data/processed/training_datasets"
+SWEEP_DIR   = os.path.join(PROCESSED_DIR, "sweeps")
+SCRATCH_DIR = "/tmp/tinker/sweep_datasets"
+
+DEFAULT_EPOCHS   = [3, 12]
+DEFAULT_VARIANTS = ["M1_exact"]
+MAX_EVALS        = 1     # checkpoint evaluations sampling at the same time
+
+
+# ── Grid ──────────────────────────────────────────────────────────────────────
+
+def variant_source(variant):
+    """(path, is_manifest) of a dataset variant."""
+    if variant in VARIANTS:
+        return os.path.abspath(VARIANTS[variant]), False
+    if variant.startswith("canary_"):
+        suffix = variant[len("canary_"):]
+        path = os.path.join(CANARY_DIR, f"tinker_train_M1_canary_{suffix}{MANIFEST_SUFFIX}")
+        return os.path.abspath(path), True
+    return os.path.abspath(variant), variant.endswith(MANIFEST_SUFFIX)
+
+
+def variant_label(variant):
+    if variant in VARIANTS or variant.startswith("canary_"):
+        return variant
+    name = os.path.basename(variant)
+    for ext in (MANIFEST_SUFFIX, ".jsonl"):
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name
+
+
+def run_name(variant, epochs, lr, rank):
+    return f"sweep_{variant_label(variant)}_{epochs}ep_lr{lr:g}_r{rank}"
+
+
+def expand_grid(epochs, learning_rates, lora_ranks, variants):
+    """One dict per grid point, in a stable order (variant-major)."""
+    points = []
+    for variant, e, lr, rank in itertools.product(variants, epochs, learning_rates, lora_ranks):
+        points.append({
+            "run":           run_name(variant, e, lr, rank),
+            "variant":       variant,
+            "epochs":        e,
+            "learning_rate": lr,
+            "lora_rank":     rank,
+        })
+    return points
+
+
+# ── Datasets ──────────────────────────────────────────────────────────────────
+
+def build_datasets(variants):
+    """
+    Training file per variant, materializing each manifest variant exactly
+    once. Returns ({variant: path}, [scratch files to remove], [missing variants]).
+    """
+    paths, scratch, missing = {}, [], []
+    for variant in variants:
+        source, is_manifest = variant_source(variant)
+        if not os.path.exists(source):
+            missing.append(variant)
+            continue
+        if not is_manifest:
+            paths[variant] = source
+            continue
+        out = os.path.join(SCRATCH_DIR, f"{variant_label(variant)}.jsonl")
+        n = materialize_manifest(source, out)
+        print(f"Materialized {variant}: {n} records → {out}")
+        paths[variant] = out
+        scratch.append(out)
+    return paths, scratch, missing
+
+
+def write_sweep(path, name, grid, points):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"sweep": name, "grid": grid, "runs": points}, f, indent=2)
+
+
+# ── Evaluation queue ──────────────────────────────────────────────────────────
+
+async def evaluate_run(name, log_path, sem):
+    from checkpoint_watcher import watch, PER_STRATUM, NUM_SAMPLES
+    async with sem:
+        print(f"\n▶ Evaluating {name} checkpoints")
+        try:
+            await watch(name, log_path, PER_STRATUM, NUM_SAMPLES, once=True)
+        except Exception as e:
+            print(f"⚠ Evaluation of {name} failed: {e!r} — re-run checkpoint_watcher.py --run {name} --once")
+
+
+# ── Main ──────────────────────────────────────────────────────────────────────
+
+async def run_sweep(name, points, max_concurrent, max_evals, evaluate, reuse=True):
+    state_file = os.path.join(SWEEP_DIR, f"{name}_job_log.json")
+    state = load_state(state_file)
+    todo = [p for p in points if not is_done(state.get(p["run"]))]
+    variants = sorted({p["variant"] for p in todo})
+
+    paths, scratch, missing = build_datasets(variants)
+    for variant in missing:
+        source, _ = variant_source(variant)
+        print(f"⚠ Dataset for {variant} not found: {source} — its runs are skipped")
+        print("  Run prepare_tinker_data.py / create_canary_data.py first.")
+
+    eval_sem = asyncio.Semaphore(max_evals)
+    evals = []
+
+    def on_done(job, entry):
+        if entry.get("reused_from"):
+            print(f"  {job.name} reuses {entry['reused_from']} — see its memorization curve")
+        elif evaluate:
+            evals.append(asyncio.create_task(evaluate_run(job.name, entry["log_path"], eval_sem)))
+
+    jobs = [
+        TrainingJob(
+            name=p["run"],
+            dataset_path=paths[p["variant"]],
+            epochs=p["epochs"],
+            meta={"sweep": name, "variant": p["variant"], "dataset": variant_source(p["variant"])[0]},
+            hparams={"learning_rate": p["learning_rate"], "lora_rank": p["lora_rank"]},
+        )
+        for p in todo if p["variant"] in paths
+    ]
+    try:
+        await run_jobs(jobs, state_file, max_concurrent=max_concurrent, on_done=on_done, reuse=reuse)
+        if evals:
+            print(f"\nWaiting for {len(evals)} queued evaluation(s)...")
+            await asyncio.gather(*evals)
+    finally:
+        for path in scratch:
+            if os.path.exists(path):
+                os.remove(path)
+    return state_file
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--name", required=True, help="Sweep name (job log / sweep file prefix)")
+    parser.add_argument("--epochs", nargs="+", type=int, default=DEFAULT_EPOCHS)
+    parser.add_argument("--lr", nargs="+", type=float, default=[LEARNING_RATE])
+    parser.add_argument("--lora-rank", nargs="+", type=int, default=[LORA_RANK])
+    parser.add_argument("--variants", nargs="+", default=DEFAULT_VARIANTS,
+                        help=f"Dataset variants: {', '.join(VARIANTS)}, canary_<suffix>, or a .jsonl path")
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT,
+                        help="Training jobs at the same time")
+    parser.add_argument("--max-evals", type=int, default=MAX_EVALS,
+                        help="Checkpoint evaluations at the same time")
+    parser.add_argument("--no-eval", action="store_true", help="Train only; don't queue evaluations")
+    parser.add_argument("--retrain", action="store_true",
+                        help="Train even when an identical finished run is in the model registry")
+    parser.add_argument("--dry-run", action="store_true", help="Print the grid and exit")
+    args = parser.parse_args()
+
+    grid = {"epochs": args.epochs, "learning_rate": args.lr,
+            "lora_rank": args.lora_rank, "variant": args.variants}
+    points = expand_grid(args.epochs, args.lr, args.lora_rank, args.variants)
+    print(f"Sweep {args.name}: {len(points)} run(s) over "
+          f"{len(args.variants)} dataset variant(s)")
+    for p in points:
+        print(f"  {p['run']}")
+    if args.dry_run:
+        return
+
+    api_key = os.environ.get("TINKER_API_KEY")
+    if not api_key:
+        try:
+            from config import TINKER_API_KEY
+            api_key = TINKER_API_KEY
+        except ImportError:
+            pass
+    if not api_key and get_backend().name == "tinker":
+        print("ERROR: TINKER_API_KEY not found in environment variables or config.py!")
+        sys.exit(1)
+    os.environ["TINKER_API_KEY"] = api_key or ""
+
+    sweep_path = os.path.join(SWEEP_DIR, f"{args.name}.json")
+    write_sweep(sweep_path, args.name, grid, points)
+    state_file = asyncio.run(run_sweep(args.name, points, args.max_concurrent,
+                                       args.max_evals, not args.no_eval, not args.retrain))
+
+    print(f"\n{'='*55}")
+    print(f"Sweep file: {sweep_path}")
+    print(f"Job log:    {state_file}")
+    print("Curves:     data/results/summaries/memorization_curve_sweep_*.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+token_stats.py
+─────────────────────────────────────────────────────────────────────────────
+Token-length report for every training file and eval prompt file.
+
+Counts come from the shared token cache (src/utils/token_cache.py), so only
+texts not seen before are tokenized. For each file prints the length
+distribution, the number of records that would be truncated at MAX_LENGTH,
+and for training files the suggested max_length / batch size and the
+tokens processed over EPOCHS epochs (the cost driver).
+
+Output: data/processed/token_stats.json
+  { file: { n, total_tokens, min, mean, p50, p90, p99, max, max_length,
+            n_truncated, [suggested_max_length, suggested_batch_size,
+            tokens_per_run] } }
+
+Run:
+  python src/03_tinker_tuning/token_stats.py
+  python src/03_tinker_tuning/token_stats.py --tokens-per-batch 16384
+"""
+
+import os
+import sys
+import json
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+
+from config import PROCESSED_DIR, OUT_M1_PATH, OUT_M2_PATH, OUT_M1_EXACT_PATH, OUT_PROMPTS_PATH
+from token_cache import TokenCache, length_stats, suggest_lengths
+
+MAX_LENGTH = 4096   # current ChatDatasetBuilderCommonConfig.max_length
+EPOCHS     = 12
+OUT_PATH   = os.path.join(PROCESSED_DIR, "token_stats.json")
+
+TRAINING_FILES = [OUT_M1_PATH, OUT_M2_PATH, OUT_M1_EXACT_PATH]
+PROMPT_FILES = [
+    OUT_PROMPTS_PATH,
+    os.path.join(PROCESSED_DIR, "eval_prompts_gene_attack.jsonl"),
+    os.path.join(PROCESSED_DIR, "eval_prompts_size_attack.jsonl"),
+    os.path.join(PROCESSED_DIR, "eval_prompts_icd10_attack.jsonl"),
+]
+
+
+def file_stats(cache, path, training, tokens_per_batch=None):
+    counts = cache.count_file(path)
+    stats = length_stats(counts, max_length=MAX_LENGTH)
+    if training:
+        max_length, batch_size = suggest_lengths(counts, MAX_LENGTH, tokens_per_batch)
+        stats["suggested_max_length"] = max_length
+        stats["suggested_batch_size"] = batch_size
+        stats["tokens_per_run"] = stats["total_tokens"] * EPOCHS
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens-per-batch", type=int, default=None,
+                        help="Size batches to this token budget (default: keep batch_size=4)")
+    args = parser.parse_args()
+
+    cache = TokenCache()
+    report = {}
+    for paths, training in ((TRAINING_FILES, True), (PROMPT_FILES, False)):
+        for path in paths:
+            if not os.path.exists(path):
+                print(f"⚠ Not found, skipping: {path}")
+                continue
+            s = file_stats(cache, path, training, args.tokens_per_batch)
+            report[os.path.basename(path)] = s
+            flag = f"  ⚠ {s['n_truncated']} truncated" if s["n_truncated"] else ""
+            print(f"{os.path.basename(path):<36} n={s['n']:>6}  mean={s['mean']:>7}  "
+                  f"p50={s['p50']:>5}  p90={s['p90']:>5}  p99={s['p99']:>5}  max={s['max']:>5}{flag}")
+            if training:
+                print(f"{'':<36} → max_length={s['suggested_max_length']}  "
+                      f"batch_size={s['suggested_batch_size']}  "
+                      f"{s['tokens_per_run']:,} tokens over {EPOCHS} epochs")
+    cache.close()
+
+    with open(OUT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✓ Token cache: {cache.hits} hits, {cache.misses} newly tokenized")
+    print(f"✓ Wrote token stats → {OUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
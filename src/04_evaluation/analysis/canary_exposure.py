@@ -0,0 +1,297 @@
+"""
+canary_exposure.py
+─────────────────────────────────────────────────────────────────────────────
+Exposure metric (Carlini et al., "The Secret Sharer") for the canaries.
+
+Hit rates from 20 samples are zero for most injection counts. Exposure is a
+graded signal: score the true canary secret against the space R of
+alternative secrets by model log-likelihood and report
+
+    exposure = log2 |R| − log2 rank(true secret)
+
+Secret spaces:
+  size   (first, intervention) diameter pairs on the canary decimal grid —
+         first in 40.1–54.9 mm, intervention 2–9 mm above, no whole-mm values
+  gene   CANDIDATE_GENES (the canary gene pool + common cohort genes); the
+         Genetics block is removed from the prompt for this secret
+
+The size space has 9,720 pairs, so instead of scoring every candidate we score
+a random sample of N_SAMPLES and estimate the rank two ways:
+  empirical      1 + (|R|−1) · fraction of sampled candidates scoring ≥ true
+  extrapolated   1 + (|R|−1) · P(X ≥ true) under a normal fit to the sampled
+                 log-likelihoods — still informative when no sampled
+                 candidate beats the true secret
+Spaces no larger than N_SAMPLES are scored exhaustively (exact rank).
+
+Scoring goes through a pluggable backend with one coroutine,
+`score(prompt, completions) -> list[float]` (summed completion log-prob):
+  tinker   Tinker sampling client compute_logprobs on a trained model
+  stub     deterministic local scorer, for testing without the service
+
+Output: data/results/summaries/canary_exposure.csv
+  patient_id | injection_count | secret | space_size | n_scored |
+  rank_empirical | exposure_empirical | exposure_extrapolated
+
+Run:
+  python src/04_evaluation/analysis/canary_exposure.py --model-path tinker://...
+  python src/04_evaluation/analysis/canary_exposure.py --backend stub
+"""
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'utils')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '02_rarity_analysis')))
+
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import math
+import random
+import re
+
+from create_canary_data import CANARY_GENE_POOL
+
+# ── Paths ─────────────────────────────────────────────────────────────────────
+MULTIPLEX_TARGET_FILE = "data/processed/eval_prompts/canary_targets_multiplex.json"
+MULTIPLEX_PROMPT_FILE = "data/processed/eval_prompts/eval_prompts_canary_multiplex.jsonl"
+OUT_CSV               = "data/results/summaries/canary_exposure.csv"
+
+BASE_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
+
+# ── Secret spaces ─────────────────────────────────────────────────────────────
+FIRST_MM_RANGE  = (40, 54)     # integer part of the first diameter
+INTERV_OFFSET   = (2, 9)       # intervention integer part = first + offset
+COHORT_GENES    = [
+    "FBN1", "TGFBR1", "TGFBR2", "SMAD3", "ACTA2", "MYH11", "MYLK", "COL3A1",
+    "TGFB2", "SMAD2",
+]
+# Every gene create_canary_data can assign, plus the common cohort genes
+CANDIDATE_GENES = list(dict.fromkeys(CANARY_GENE_POOL + COHORT_GENES))
+
+N_SAMPLES  = 1000     # candidates scored per secret before extrapolating
+BATCH_SIZE = 50       # completions per backend call
+SEED       = 0
+
+
+def size_space():
+    """All (first, intervention) pairs on the canary decimal grid."""
+    lo, hi = FIRST_MM_RANGE
+    space = []
+    for a in range(lo, hi + 1):
+        for da in range(1, 10):
+            for b in range(a + INTERV_OFFSET[0], a + INTERV_OFFSET[1] + 1):
+                for db in range(1, 10):
+                    space.append((f"{a}.{da}", f"{b}.{db}"))
+    return space
+
+
+def completion_through(full_completion, marker_regex):
+    """Truncate the canary completion right after the secret-bearing line."""
+    m = re.search(marker_regex, full_completion)
+    return full_completion[:m.end()] if m else full_completion
+
+
+def size_secret(target, prompt):
+    """(prompt, render(candidate), true candidate, space) for the diameter secret."""
+    prefix = completion_through(target["full_completion"], r"Diameter at intervention: [^\n]*")
+
+    def render(pair):
+        text = re.sub(r"(First reported diameter: )[\d.]+( mm)", rf"\g<1>{pair[0]}\g<2>", prefix)
+        return re.sub(r"(Diameter at intervention: )[\d.]+( mm)", rf"\g<1>{pair[1]}\g<2>", text)
+
+    true = (target["first_diameter_mm"], target["interv_diameter_mm"])
+    return prompt, render, true, size_space()
+
+
+def gene_secret(target, prompt):
+    """Gene secret: Genetics block removed from the prompt, completion scored through it."""
+    prompt = re.sub(r"Genetics:\n(?:- [^\n]*\n?)+\n?", "", prompt)
+    prefix = completion_through(target["full_completion"], r"Pathogenic variant: [^\n]*")
+
+    def render(gene):
+        return re.sub(r"(Pathogenic variant: )\S+", rf"\g<1>{gene}", prefix)
+
+    space = list(CANDIDATE_GENES)
+    true = next((g for g in space if g.lower() == target["gene"].lower()), None)
+    if true is None:   # gene from an older pool — score it against the current space
+        true = target["gene"]
+        space.append(true)
+    return prompt, render, true, space
+
+
+SECRETS = {"size": size_secret, "gene": gene_secret}
+
+
+# ── Backends ──────────────────────────────────────────────────────────────────
+
+class StubLogprobBackend:
+    """
+    Deterministic offline scorer. Each completion gets a pseudo-random
+    log-likelihood around -40 (hash-seeded, so reruns agree), plus
+    `memorized_bonus` if it contains any string in `memorized`.
+    """
+
+    def __init__(self, memorized=(), memorized_bonus=10.0, latency=0.0):
+        self.memorized = list(memorized)
+        self.memorized_bonus = memorized_bonus
+        self.latency = latency
+        self.calls = 0
+
+    async def score(self, prompt, completions):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        scores = []
+        for c in completions:
+            seed = int.from_bytes(hashlib.sha256((prompt + c).encode("utf-8")).digest()[:8], "big")
+            lp = random.Random(seed).gauss(-40.0, 3.0)
+            if any(m in c for m in self.memorized):
+                lp += self.memorized_bonus
+            scores.append(lp)
+        return scores
+
+
+class TinkerLogprobBackend:
+    """Summed completion log-prob from a Tinker sampling client (compute_logprobs)."""
+
+    def __init__(self, model_path):
+        sys.path.append(os.path.expanduser("~/tinker/tinker-cookbook"))
+        import tinker
+        from tinker.lib.public_interfaces.service_client import ServiceClient
+        from tinker_cookbook.renderers import get_renderer
+        from tinker_cookbook.tokenizer_utils import get_tokenizer
+
+        self._tinker = tinker
+        self.sampling_client = ServiceClient().create_sampling_client(model_path=model_path)
+        self.tokenizer = get_tokenizer(BASE_MODEL)
+        self.renderer = get_renderer("llama3", tokenizer=self.tokenizer)
+
+    async def score(self, prompt, completions):
+        prompt_tokens = self.renderer.build_generation_prompt(
+            [{"role": "user", "content": prompt}]
+        ).to_ints()
+
+        async def one(completion):
+            tokens = prompt_tokens + self.tokenizer.encode(completion, add_special_tokens=False)
+            logprobs = await self.sampling_client.compute_logprobs_async(
+                self._tinker.ModelInput.from_ints(tokens)
+            )
+            return float(sum(lp for lp in logprobs[len(prompt_tokens):] if lp is not None))
+
+        return list(await asyncio.gather(*(one(c) for c in completions)))
+
+
+def get_backend(name, model_path=None, targets=()):
+    if name == "stub":
+        # Memorize the secrets of canaries injected >= 5 times, so the curve has shape
+        memorized = [f"First reported diameter: {t['first_diameter_mm']} mm"
+                     for t in targets if t.get("injection_count", 0) >= 5]
+        return StubLogprobBackend(memorized=memorized)
+    if name == "tinker":
+        if not model_path:
+            raise ValueError("--model-path is required for the tinker backend")
+        return TinkerLogprobBackend(model_path)
+    raise ValueError(f"Unknown backend: {name}")
+
+
+# ── Exposure ──────────────────────────────────────────────────────────────────
+
+async def score_batched(backend, prompt, completions, batch_size=BATCH_SIZE):
+    batches = [completions[i:i + batch_size] for i in range(0, len(completions), batch_size)]
+    results = await asyncio.gather(*(backend.score(prompt, b) for b in batches))
+    return [s for batch in results for s in batch]
+
+
+def normal_tail(x, scores):
+    """P(X >= x) under a normal fit to scores."""
+    n = len(scores)
+    mu = sum(scores) / n
+    var = sum((s - mu) ** 2 for s in scores) / max(n - 1, 1)
+    if var <= 0:
+        return 1.0 if x <= mu else 0.0
+    return 0.5 * math.erfc((x - mu) / math.sqrt(2 * var))
+
+
+async def estimate_exposure(backend, prompt, render, true, space,
+                            n_samples=N_SAMPLES, batch_size=BATCH_SIZE, rng=None):
+    """Score the true secret against (a sample of) its space and estimate exposure."""
+    rng = rng or random.Random(SEED)
+    others = [c for c in space if c != true]
+    exhaustive = len(others) <= n_samples
+    sample = others if exhaustive else rng.sample(others, n_samples)
+
+    scores = await score_batched(backend, prompt, [render(true)] + [render(c) for c in sample], batch_size)
+    true_score, sample_scores = scores[0], scores[1:]
+
+    size = len(space)
+    beats = sum(s >= true_score for s in sample_scores)
+    if exhaustive:
+        rank = 1 + beats
+        rank_ext = rank
+    else:
+        rank = 1 + (size - 1) * beats / len(sample_scores)
+        rank_ext = 1 + (size - 1) * normal_tail(true_score, sample_scores)
+
+    return {
+        "space_size":            size,
+        "n_scored":              len(scores),
+        "rank_empirical":        rank,
+        "exposure_empirical":    math.log2(size) - math.log2(rank),
+        "exposure_extrapolated": math.log2(size) - math.log2(rank_ext),
+    }
+
+
+async def run(backend, targets, prompts, secrets, n_samples):
+    rows = []
+    for t in targets:
+        prompt_text = prompts[t["patient_id"]]
+        for secret in secrets:
+            prompt, render, true, space = SECRETS[secret](t, prompt_text)
+            r = await estimate_exposure(backend, prompt, render, true, space, n_samples=n_samples)
+            rows.append({"patient_id": t["patient_id"],
+                         "injection_count": t.get("injection_count"),
+                         "secret": secret, **r})
+            print(f"  {t['patient_id']} [{t.get('injection_count')}×] {secret:<4} "
+                  f"|R|={r['space_size']:>6}  exposure={r['exposure_empirical']:.2f} "
+                  f"(extrapolated {r['exposure_extrapolated']:.2f})")
+    return rows
+
+
+def load_targets(target_file, prompt_file):
+    with open(target_file) as f:
+        targets = json.load(f)
+    if isinstance(targets, dict):
+        targets = [targets]
+    with open(prompt_file) as f:
+        prompts = {p["patient_id"]: p["prompt_text"] for p in map(json.loads, f)}
+    return targets, prompts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["tinker", "stub"], default="tinker")
+    parser.add_argument("--model-path", default=None, help="Tinker sampler path of the canary model")
+    parser.add_argument("--targets", default=MULTIPLEX_TARGET_FILE)
+    parser.add_argument("--prompts", default=MULTIPLEX_PROMPT_FILE)
+    parser.add_argument("--secrets", nargs="+", default=list(SECRETS), choices=list(SECRETS))
+    parser.add_argument("--samples", type=int, default=N_SAMPLES)
+    parser.add_argument("--out", default=OUT_CSV)
+    args = parser.parse_args()
+
+    targets, prompts = load_targets(args.targets, args.prompts)
+    backend = get_backend(args.backend, args.model_path, targets)
+    print(f"Scoring exposure for {len(targets)} canaries with the {args.backend} backend …")
+    rows = asyncio.run(run(backend, targets, prompts, args.secrets, args.samples))
+
+    os.makedirs(os.path.dirname(args.out), exist_ok=True)
+    with open(args.out, "w", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0]))
+        w.writeheader()
+        w.writerows(rows)
+    print(f"\n✓ Wrote exposure table → {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'utils')))
 
 import json
 import re
 import pandas as pd
 from sklearn.metrics import roc_auc_score
 
+from splits_cache import check_record_fingerprints
+
 SURG_CONCEPTS = [
     "Aortic root repair",
     "Aortic root replacement",
@@ -198,6 +201,7 @@ def evaluate_phase2(model_name, attack_name, prediction_file):
 
 def main():
     prompts = load_ground_truth()
+    check_record_fingerprints(list(prompts.values()), "eval_prompts.jsonl")
     
     print("Evaluating Phase I (M0 Base)...")
     df_m0 = evaluate_model("M0", "data/results/M0_predictions.jsonl", prompts, is_coarse=False)
@@ -248,6 +252,8 @@ def main():
         for model in models:
             pred_file = f"data/results/{model}_{attack}_predictions.jsonl"
             if os.path.exists(pred_file):
+                with open(pred_file) as f:
+                    check_record_fingerprints([json.loads(line) for line in f], pred_file)
                 df = evaluate_phase2(model, attack, pred_file)
                 phase2_dfs.append(df)
                 
@@ -0,0 +1,247 @@
+"""
+checkpoint_watcher.py
+─────────────────────────────────────────────────────────────────────────────
+Per-checkpoint memorization curve from a single training run.
+
+Follows a run's checkpoints.jsonl (located through the model registry, or
+--log-dir) while it trains. For every new sampler checkpoint it runs a
+reduced attack suite — a fixed stratified subset of the gene, size and
+ICD-10 attack prompts, PER_STRATUM prompts per (split, rarity_group) — and
+appends the scores to the run's memorization curve. One 12-epoch run then
+yields the whole epoch curve instead of separate 3- and 12-epoch models.
+
+Only checkpoint entries carrying a sampler_path can be sampled; the run's
+save cadence (train.Config.save_every) sets the curve's resolution.
+
+Scoring reuses the Phase II/III definitions:
+  gene   gene_success         (generate_gene_size_summary_csv.py)
+  size   size_success_strict  (generate_gene_size_summary_csv.py)
+  icd10  best_recall > 0, plus mean best recall (generate_icd10_summary_csv.py)
+
+Outputs:
+  data/results/checkpoint_curve/<run>/subset.json
+  data/results/checkpoint_curve/<run>/<checkpoint>_<attack>_predictions.jsonl
+  data/results/summaries/memorization_curve_<run>.csv
+    run | checkpoint | epoch | batch | sampler_path | attack | split |
+    rarity_group | n | hits | rate | mean_recall
+
+Run (alongside training, or afterwards with --once):
+  python src/04_evaluation/generation/checkpoint_watcher.py --run M1_Exact_Age_12_Epochs
+  python src/04_evaluation/generation/checkpoint_watcher.py --run M1_Exact_Age_12_Epochs --once
+"""
+
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'utils')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'analysis')))
+
+import csv
+import json
+import random
+import asyncio
+import argparse
+from pathlib import Path
+
+from generate_predictions import generate_for_model
+from model_registry import get_run, read_checkpoint_log
+from tinker_backend import get_backend
+from generate_gene_size_summary_csv import (
+    extract_gene_target, gene_success, extract_size_target, size_success_strict,
+)
+from generate_icd10_summary_csv import parse_gt, best_recall
+
+# ── Config ────────────────────────────────────────────────────────────────────
+ATTACK_FILES = {
+    "gene":  "data/processed/eval_prompts_gene_attack.jsonl",
+    "size":  "data/processed/eval_prompts_size_attack.jsonl",
+    "icd10": "data/processed/eval_prompts_icd10_attack.jsonl",
+}
+PER_STRATUM   = 10      # prompts per (split, rarity_group) per attack
+NUM_SAMPLES   = 5       # generations per prompt
+POLL_SECONDS  = 120
+SEED          = 42
+
+OUT_DIR     = "data/results/checkpoint_curve"
+SUMMARY_DIR = "data/results/summaries"
+
+CURVE_COLUMNS = ["run", "checkpoint", "epoch", "batch", "sampler_path", "attack",
+                 "split", "rarity_group", "n", "hits", "rate", "mean_recall"]
+
+
+# ── Attack subset ─────────────────────────────────────────────────────────────
+
+def scorable(attack, prompt):
+    """Skip prompts whose target has nothing to recall (same filters as the summaries)."""
+    if attack == "gene":
+        return extract_gene_target(prompt["target_text"])[0] is not None
+    if attack == "size":
+        return any(extract_size_target(prompt["target_text"]))
+    return bool(parse_gt(prompt.get("target_icd10") or prompt.get("target_icd10_raw", "")))
+
+
+def stratified_subset(prompts, attack, per_stratum=PER_STRATUM, seed=SEED):
+    strata = {}
+    for p in prompts:
+        if scorable(attack, p):
+            strata.setdefault((p["split"], p["rarity_group"]), []).append(p)
+    rng = random.Random(seed)
+    subset = []
+    for key in sorted(strata):
+        group = strata[key]
+        subset.extend(rng.sample(group, min(per_stratum, len(group))))
+    return subset
+
+
+def load_subset(run_dir, per_stratum):
+    """The run's fixed attack subset, built once so every checkpoint sees the same prompts."""
+    path = os.path.join(run_dir, "subset.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    subset = {}
+    for attack, prompt_file in ATTACK_FILES.items():
+        if not os.path.exists(prompt_file):
+            print(f"⚠ {prompt_file} not found — {attack} attack skipped")
+            continue
+        with open(prompt_file) as f:
+            prompts = [json.loads(line) for line in f]
+        subset[attack] = stratified_subset(prompts, attack, per_stratum)
+    os.makedirs(run_dir, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(subset, f)
+    return subset
+
+
+# ── Scoring ───────────────────────────────────────────────────────────────────
+
+def score_record(attack, rec):
+    """(hit, recall) for one prediction record."""
+    gens = rec["generations"]
+    if attack == "gene":
+        return gene_success(extract_gene_target(rec["target_text"])[0], gens), None
+    if attack == "size":
+        v1, v2 = extract_size_target(rec["target_text"])
+        return size_success_strict(v1, v2, gens), None
+    recall, _ = best_recall(parse_gt(rec.get("target_icd10") or rec.get("target_icd10_raw", "")), gens)
+    return recall > 0, recall
+
+
+def score_checkpoint(attack, prompts, pred_file):
+    """Curve rows (per split × rarity_group) for one attack at one checkpoint."""
+    by_id = {p["prompt_id"]: p for p in prompts}
+    groups = {}
+    with open(pred_file) as f:
+        for line in f:
+            pred = json.loads(line)
+            rec = {**by_id[pred["prompt_id"]], **pred}
+            hit, recall = score_record(attack, rec)
+            groups.setdefault((rec["split"], rec["rarity_group"]), []).append((hit, recall))
+    rows = []
+    for (split, group), results in sorted(groups.items()):
+        hits = sum(h for h, _ in results)
+        recalls = [r for _, r in results if r is not None]
+        rows.append({
+            "attack": attack, "split": split, "rarity_group": group,
+            "n": len(results), "hits": hits, "rate": hits / len(results),
+            "mean_recall": sum(recalls) / len(recalls) if recalls else None,
+        })
+    return rows
+
+
+# ── Watcher ───────────────────────────────────────────────────────────────────
+
+def done_checkpoints(curve_csv):
+    if not os.path.exists(curve_csv):
+        return set()
+    with open(curve_csv) as f:
+        return {row["sampler_path"] for row in csv.DictReader(f)}
+
+
+def append_rows(curve_csv, rows):
+    new = not os.path.exists(curve_csv)
+    os.makedirs(os.path.dirname(curve_csv), exist_ok=True)
+    with open(curve_csv, "a", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=CURVE_COLUMNS)
+        if new:
+            w.writeheader()
+        w.writerows(rows)
+
+
+async def evaluate_checkpoint(run, entry, subset, run_dir, num_samples):
+    """Curve rows for one checkpoint, or None if some prompts failed (retried next poll)."""
+    name = str(entry.get("name") or entry.get("batch") or "ckpt")
+    rows = []
+    for attack, prompts in subset.items():
+        pred_file = Path(run_dir) / f"{name}_{attack}_predictions.jsonl"
+        await generate_for_model(entry["sampler_path"], False, prompts, pred_file, num_samples=num_samples,
+                                 prompts_path=ATTACK_FILES.get(attack))
+        with open(pred_file) as f:
+            n_done = sum(1 for _ in f)
+        if n_done < len(prompts):
+            print(f"⚠ {name}/{attack}: {n_done}/{len(prompts)} prompts sampled — will retry")
+            return None
+        for row in score_checkpoint(attack, prompts, pred_file):
+            rows.append({"run": run, "checkpoint": name, "epoch": entry.get("epoch"),
+                         "batch": entry.get("batch"), "sampler_path": entry["sampler_path"], **row})
+    return rows
+
+
+async def watch(run, log_dir, per_stratum, num_samples, once):
+    run_dir = os.path.join(OUT_DIR, run)
+    curve_csv = os.path.join(SUMMARY_DIR, f"memorization_curve_{run}.csv")
+    subset = load_subset(run_dir, per_stratum)
+    print(f"Watching {log_dir}/checkpoints.jsonl — "
+          + ", ".join(f"{a}: {len(p)} prompts" for a, p in subset.items()))
+
+    while True:
+        done = done_checkpoints(curve_csv)
+        pending = [e for e in read_checkpoint_log(log_dir)
+                   if "://" in (e.get("sampler_path") or "") and e["sampler_path"] not in done]
+        for entry in pending:
+            print(f"\n▶ Checkpoint {entry.get('name')} (epoch {entry.get('epoch')}) → {entry['sampler_path']}")
+            rows = await evaluate_checkpoint(run, entry, subset, run_dir, num_samples)
+            if rows is None:
+                continue
+            append_rows(curve_csv, rows)
+            for r in rows:
+                if r["split"] == "train":
+                    print(f"  {r['attack']:<5} train/{r['rarity_group']:<10} {r['hits']}/{r['n']} = {r['rate']*100:.1f}%")
+            print(f"✓ Appended to {curve_csv}")
+
+        if once:
+            return
+        status = (get_run(run) or {}).get("status")
+        if status in ("done", "failed") and not pending:
+            print(f"\nRun {run} is {status}; all sampler checkpoints evaluated.")
+            return
+        await asyncio.sleep(POLL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--run", required=True, help="Run name (model registry / log dir suffix)")
+    parser.add_argument("--log-dir", default=None, help="Override the run's log dir")
+    parser.add_argument("--per-stratum", type=int, default=PER_STRATUM)
+    parser.add_argument("--num-samples", type=int, default=NUM_SAMPLES)
+    parser.add_argument("--once", action="store_true", help="Evaluate existing checkpoints and exit")
+    args = parser.parse_args()
+
+    api_key = os.environ.get("TINKER_API_KEY")
+    if not api_key:
+        try:
+            from config import TINKER_API_KEY
+            api_key = TINKER_API_KEY
+        except ImportError:
+            pass
+    if not api_key and get_backend().name == "tinker":
+        print("ERROR: TINKER_API_KEY not found in environment variables or config.py!")
+        sys.exit(1)
+    os.environ["TINKER_API_KEY"] = api_key or ""
+
+    log_dir = args.log_dir or (get_run(args.run) or {}).get("log_path") \
+        or f"/tmp/tinker/aortic_memorization_{args.run}"
+    asyncio.run(watch(args.run, log_dir, args.per_stratum, args.num_samples, args.once))
+
+
+if __name__ == "__main__":
+    main()
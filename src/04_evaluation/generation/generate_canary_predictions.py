@@ -7,15 +7,28 @@ canary patient eval prompt. Run AFTER Tinker fine-tuning jobs complete.
 Usage:
   python src/04_evaluation/generation/generate_canary_predictions.py
 
+All configured canary models are sampled concurrently in one event loop,
+through the same async path as generate_predictions.py: one sample_async
+call with num_samples=N_GENERATIONS per prompt instead of N sequential
+requests. The phase takes as long as the slowest model. Output is resumable
+per model: finished canary_{N}x files are skipped, and the multiplex file is
+appended per canary as each one completes.
+
 Output:
   data/results/predictions/canary/canary_{N}x_predictions.jsonl
   (one file per injection count)
 
+  data/results/predictions/canary/canary_multiplex_predictions.jsonl
+  (multiplexed run: one record per canary patient)
+
 Configuration:
-  Update MODEL_IDS below with the Tinker model IDs for each canary run
-  once your fine-tuning jobs complete.
+  Models are resolved from the model registry by run name
+  (canary_{N}x_12ep, canary_multiplex_12ep), which launch_canary_jobs.py
+  fills in as training progresses. Entries set in MODEL_IDS /
+  MULTIPLEX_MODEL_ID below override the registry.
 """
 
+import asyncio
 import json
 import os
 import sys
@@ -26,11 +39,13 @@ try:
 except ImportError:
     TINKER_API_KEY = os.environ.get("TINKER_API_KEY", "")
 
-from tinker_cookbook import SamplingClient  # noqa
+from generate_predictions import sample_with_retry
+from model_registry import resolve_model
+from tinker_backend import sampling_client, shared_tokenizer, shared_renderer
 
-# ── Configure after Tinker training jobs complete ────────────────────────────
-# Fill in the model ID for each injection count once jobs finish.
-# Leave as None to skip that count.
+# ── Model overrides ──────────────────────────────────────────────────────────
+# Leave as None to resolve canary_{N}x_12ep from the model registry; counts
+# with neither an override nor a registered sampler are skipped.
 MODEL_IDS = {
     0:  None,   # M1 baseline (no canary) — use existing M1 model ID if available
     1:  None,   # canary injected 1×
@@ -40,11 +55,16 @@ MODEL_IDS = {
     25: None,   # canary injected 25×
 }
 
+# Model trained on tinker_train_M1_canary_multiplex (all canaries, all counts)
+MULTIPLEX_MODEL_ID = None
+
+BASE_MODEL    = "meta-llama/Llama-3.1-8B-Instruct"
 N_GENERATIONS = 20    # more samples than usual to get a reliable recall rate
 TEMPERATURE   = 1.0
 MAX_TOKENS    = 600
 
 EVAL_PROMPT_FILE = "data/processed/eval_prompts/eval_prompts_canary.jsonl"
+MULTIPLEX_PROMPT_FILE = "data/processed/eval_prompts/eval_prompts_canary_multiplex.jsonl"
 OUT_DIR          = "data/results/predictions/canary"
 
 
@@ -53,50 +73,120 @@ def load_prompt():
         return json.loads(f.readline())
 
 
-def generate(model_id, prompt_text, n, temperature, max_tokens):
-    client = SamplingClient(api_key=TINKER_API_KEY, model=model_id)
-    generations = []
-    for _ in range(n):
-        response = client.sample(
-            messages=[{"role": "user", "content": prompt_text}],
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-        generations.append(response)
-    return generations
+class CanarySampler:
+    """One Tinker sampling client per model, sharing a tokenizer and renderer (see tinker_backend)."""
+
+    def __init__(self):
+        self.tokenizer = shared_tokenizer(BASE_MODEL)
+        self.renderer = shared_renderer(BASE_MODEL)
+        self.stop_condition = self.renderer.get_stop_sequences()
+
+    def client(self, model_id):
+        return sampling_client(model_path=model_id)
+
+    async def generate(self, sampling_client, prompt_text, n=N_GENERATIONS,
+                       temperature=TEMPERATURE, max_tokens=MAX_TOKENS):
+        minput = self.renderer.build_generation_prompt([{"role": "user", "content": prompt_text}])
+        result = await sample_with_retry(sampling_client, minput, n, self.stop_condition,
+                                         temperature=temperature, max_tokens=max_tokens)
+        return [self.renderer.parse_response(seq.tokens)[0]["content"] for seq in result.sequences]
+
+
+async def generate_single(sampler, injection_count, model_id, prompt):
+    """Sample the single canary prompt from one injection-count model."""
+    out_path = os.path.join(OUT_DIR, f"canary_{injection_count}x_predictions.jsonl")
+    if os.path.exists(out_path):
+        print(f"Already exists, skipping: {out_path}")
+        return
+
+    print(f"Generating {N_GENERATIONS} samples from {injection_count}× model ({model_id}) …")
+    gens = await sampler.generate(sampler.client(model_id), prompt["prompt_text"])
+
+    record = {
+        "injection_count": injection_count,
+        "model_id":        model_id,
+        "patient_id":      prompt["patient_id"],
+        "prompt_id":       prompt["prompt_id"],
+        "generations":     gens,
+    }
+    # Write via a temp file so an interrupted run never leaves a partial record
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(record) + "\n")
+    os.replace(tmp_path, out_path)
+    print(f"  [{injection_count}×] Wrote → {out_path}")
+
+
+async def generate_multiplex(sampler, model_id):
+    """Sample every multiplexed canary prompt from the single multiplex model concurrently."""
+    out_path = os.path.join(OUT_DIR, "canary_multiplex_predictions.jsonl")
+    done = set()
+    if os.path.exists(out_path):
+        with open(out_path) as f:
+            done = {json.loads(line)["patient_id"] for line in f}
+
+    with open(MULTIPLEX_PROMPT_FILE) as f:
+        prompts = [json.loads(line) for line in f]
+    remaining = [p for p in prompts if p["patient_id"] not in done]
+    print(f"Multiplex model ({model_id}): {len(done)} canaries done, {len(remaining)} remaining")
+
+    sampling_client = sampler.client(model_id)
+
+    async def one(p):
+        return p, await sampler.generate(sampling_client, p["prompt_text"])
+
+    with open(out_path, "a") as f:
+        for task in asyncio.as_completed([one(p) for p in remaining]):
+            try:
+                p, gens = await task
+            except Exception as e:
+                print(f"  Error on a multiplex canary: {e}")
+                continue
+            f.write(json.dumps({
+                "injection_count": p["injection_count"],
+                "model_id":        model_id,
+                "patient_id":      p["patient_id"],
+                "prompt_id":       p["prompt_id"],
+                "generations":     gens,
+            }) + "\n")
+            f.flush()
+    print(f"  Wrote → {out_path}")
+
+
+async def main():
+    os.makedirs(OUT_DIR, exist_ok=True)
+    if TINKER_API_KEY:
+        os.environ.setdefault("TINKER_API_KEY", TINKER_API_KEY)
 
+    sampler = CanarySampler()
+    jobs = []
+    labels = []
 
-def main():
-    os.makedirs(OUT_DIR, exist_ok=True)
-    prompt = load_prompt()
+    multiplex_id = MULTIPLEX_MODEL_ID or resolve_model("canary_multiplex_12ep")
+    if multiplex_id is not None:
+        jobs.append(generate_multiplex(sampler, multiplex_id))
+        labels.append("multiplex")
 
+    configured = {}
     for injection_count, model_id in MODEL_IDS.items():
+        model_id = model_id or resolve_model(f"canary_{injection_count}x_12ep")
         if model_id is None:
-            print(f"Skipping {injection_count}× — no model ID configured")
-            continue
-
-        out_path = os.path.join(OUT_DIR, f"canary_{injection_count}x_predictions.jsonl")
-        if os.path.exists(out_path):
-            print(f"Already exists, skipping: {out_path}")
+            print(f"Skipping {injection_count}× — no model ID configured or registered")
             continue
-
-        print(f"Generating {N_GENERATIONS} samples from {injection_count}× model ({model_id}) …")
-        gens = generate(model_id, prompt["prompt_text"],
-                        N_GENERATIONS, TEMPERATURE, MAX_TOKENS)
-
-        record = {
-            "injection_count": injection_count,
-            "model_id":        model_id,
-            "patient_id":      prompt["patient_id"],
-            "prompt_id":       prompt["prompt_id"],
-            "generations":     gens,
-        }
-        with open(out_path, "w") as f:
-            f.write(json.dumps(record) + "\n")
-        print(f"  Wrote → {out_path}")
+        configured[injection_count] = model_id
+    if configured:
+        prompt = load_prompt()
+        for injection_count, model_id in configured.items():
+            jobs.append(generate_single(sampler, injection_count, model_id, prompt))
+            labels.append(f"{injection_count}×")
+
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    for label, result in zip(labels, results):
+        if isinstance(result, Exception):
+            print(f"ERROR: {label} model failed: {result} (re-run to resume)")
 
     print("\nDone. Run evaluate_canary.py to compute memorization threshold curve.")
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
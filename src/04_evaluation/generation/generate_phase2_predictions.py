@@ -5,32 +5,34 @@ import asyncio
 import tenacity
 from pathlib import Path
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'utils')))
 
-# Provide local path to tinker_cookbook
-sys.path.append("/Users/lolcreative883/tinker/tinker-cookbook")
-    
-import tinker
-from tinker.lib.public_interfaces.service_client import ServiceClient
-from tinker_cookbook.renderers import get_renderer
-from tinker_cookbook.tokenizer_utils import get_tokenizer
+from model_registry import resolve_model
+from tinker_backend import get_backend, sampling_client, shared_renderer
+from prompt_cache import get_prompt_cache
+from request_scheduler import (
+    run_sliding_window, send, record_failures, Hedger, MAX_IN_FLIGHT, HEDGE_ENABLED,
+)
 
 @tenacity.retry(
-    wait=tenacity.wait_exponential(multiplier=1, min=4, max=60),
+    # Jitter so tasks that failed together don't retry in lockstep
+    wait=tenacity.wait_exponential(multiplier=1, min=4, max=60) + tenacity.wait_random(0, 4),
     stop=tenacity.stop_after_attempt(5)
 )
-async def sample_with_retry(sampling_client, minput, num_samples, stop_condition):
-    return await sampling_client.sample_async(
+async def sample_with_retry(client, minput, num_samples, stop_condition, hedger=None):
+    # Each attempt is sent (and, with a hedger, hedged) on its own inside the retry
+    return await send(lambda: client.sample_async(
         minput,
         num_samples=num_samples,
-        sampling_params=tinker.SamplingParams(
+        sampling_params=get_backend().sampling_params(
             temperature=1.0,
             max_tokens=2048,
             stop=stop_condition,
         )
-    )
+    ), hedger)
 
-async def generate_for_model(model_name_or_id, is_base_model, prompts_file, output_file, num_samples=10, batch_size=50):
+async def generate_for_model(model_name_or_id, is_base_model, prompts_file, output_file, num_samples=10, max_in_flight=MAX_IN_FLIGHT,
+                             hedge=HEDGE_ENABLED):
     if not prompts_file.exists():
         print(f"Could not find prompts at {prompts_file}")
         return
@@ -40,15 +42,12 @@ async def generate_for_model(model_name_or_id, is_base_model, prompts_file, outp
         for line in f:
             prompts.append(json.loads(line))
 
-    client = ServiceClient()
-    
+    # Clients, tokenizer and renderer are shared by every model / attack in the process
     if is_base_model:
-        sampling_client = client.create_sampling_client(base_model=model_name_or_id)
+        client = sampling_client(base_model=model_name_or_id)
     else:
-        sampling_client = client.create_sampling_client(model_path=model_name_or_id)
-        
-    tokenizer = get_tokenizer("meta-llama/Llama-3.1-8B-Instruct")
-    renderer = get_renderer("llama3", tokenizer=tokenizer)
+        client = sampling_client(model_path=model_name_or_id)
+    renderer = shared_renderer()
     stop_condition = renderer.get_stop_sequences()
     
     # Check if we already have some done
@@ -62,51 +61,51 @@ async def generate_for_model(model_name_or_id, is_base_model, prompts_file, outp
     
     print(f"Generating for {model_name_or_id} on {prompts_file.name}. {len(completed_ids)} already done, {len(remaining_prompts)} remaining.")
     if not remaining_prompts:
+        record_failures(output_file, [])
         return
         
-    out_f = open(output_file, "a")
-    
-    async def process_batch(batch):
-        model_inputs = []
-        for p in batch:
-            messages = [{"role": "user", "content": p["prompt_text"]}]
-            model_inputs.append(renderer.build_generation_prompt(messages))
-            
-        tasks = []
-        for minput in model_inputs:
-            tasks.append(
-                sample_with_retry(sampling_client, minput, num_samples, stop_condition)
-            )
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        for p, result in zip(batch, results):
-            if isinstance(result, Exception):
-                print(f"Error on {p['prompt_id']}: {result}")
-                continue
-                
-            generations = []
-            for seq in result.sequences:
-                parsed_message, _ = renderer.parse_response(seq.tokens)
-                generations.append(parsed_message["content"])
-                
-            out_obj = {
-                "prompt_id": p["prompt_id"],
-                "patient_id": p["patient_id"],
-                "split": p["split"],
-                "rarity_group": p["rarity_group"],
-                "target_text": p["target_text"], # Make sure we save the target!
-                "generations": generations
-            }
-            out_f.write(json.dumps(out_obj) + "\n")
-            out_f.flush()
+    # Rendered once per prompt text and reused by every model and rerun
+    prompt_cache = get_prompt_cache(prompts_file)
+    inputs = prompt_cache.model_inputs(remaining_prompts)
+    print(f"  {prompt_cache.summary()}")
 
-    for i in range(0, len(remaining_prompts), batch_size):
-        batch = remaining_prompts[i:i+batch_size]
-        print(f"Processing batch {i//batch_size + 1}/{(len(remaining_prompts)-1)//batch_size + 1}...")
-        await process_batch(batch)
-        
-    out_f.close()
+    hedger = Hedger() if hedge else None
+
+    async def sample_prompt(p):
+        minput = inputs[p["prompt_id"]]
+        return await sample_with_retry(client, minput, num_samples, stop_condition, hedger=hedger)
+
+    failures = []
+
+    def write_result(p, result):
+        if isinstance(result, Exception):
+            print(f"Error on {p['prompt_id']}: {result}")
+            failures.append((p, result))
+            return
+
+        generations = []
+        for seq in result.sequences:
+            parsed_message, _ = renderer.parse_response(seq.tokens)
+            generations.append(parsed_message["content"])
+
+        out_obj = {
+            "prompt_id": p["prompt_id"],
+            "patient_id": p["patient_id"],
+            "split": p["split"],
+            "rarity_group": p["rarity_group"],
+            "target_text": p["target_text"], # Make sure we save the target!
+            "splits_fingerprint": p.get("splits_fingerprint"),
+            "generations": generations
+        }
+        out_f.write(json.dumps(out_obj) + "\n")
+        out_f.flush()
+
+    # Sliding window: up to max_in_flight requests at once, each written as it completes
+    with open(output_file, "a") as out_f:
+        await run_sliding_window(remaining_prompts, sample_prompt, write_result, max_in_flight)
+    record_failures(output_file, failures)
+    if hedger:
+        print(f"  {hedger.summary()}")
 
 async def main():
     import json
@@ -119,16 +118,18 @@ async def main():
         except ImportError:
             pass
             
-    if not api_key:
+    if not api_key and get_backend().name == "tinker":
         print("ERROR: TINKER_API_KEY not found in environment variables or config.py!")
         sys.exit(1)
         
-    os.environ["TINKER_API_KEY"] = api_key
+    os.environ["TINKER_API_KEY"] = api_key or ""
     
-    # Extracted Model IDs from the successful Tinker runs
-    # (Logs showed these URIs at checkpoints)
-    M1_12_EPOCH = "tinker://3b61c546-ea00-56ea-a1f3-93f3576dfd34:train:0/sampler_weights/final" 
-    M2_12_EPOCH = "tinker://35dbde86-8ca9-5616-987c-c8245d8f381b:train:0/sampler_weights/final"
+    # Resolved from the model registry; the fallbacks are the URIs extracted
+    # from the original successful Tinker runs (logs showed these at checkpoints)
+    M1_12_EPOCH = resolve_model("M1_Exact_Age_12_Epochs",
+                                default="tinker://3b61c546-ea00-56ea-a1f3-93f3576dfd34:train:0/sampler_weights/final")
+    M2_12_EPOCH = resolve_model("M2_Coarsened_12_Epochs",
+                                default="tinker://35dbde86-8ca9-5616-987c-c8245d8f381b:train:0/sampler_weights/final")
     M0 = "meta-llama/Llama-3.1-8B-Instruct"
     
     out_dir = Path("data/results")
@@ -1,6 +1,6 @@
 import os
 import sys
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'utils')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'utils')))
 
 import os
 import sys
@@ -9,41 +9,39 @@ import asyncio
 import tenacity
 from pathlib import Path
 
-# Provide local path to tinker_cookbook
-sys.path.append("/Users/lolcreative883/tinker/tinker-cookbook")
-    
-import tinker
-from tinker.lib.public_interfaces.service_client import ServiceClient
-from tinker_cookbook.renderers import get_renderer
-
-
-from tinker_cookbook.tokenizer_utils import get_tokenizer
+from model_registry import resolve_model
+from tinker_backend import get_backend, sampling_client, shared_renderer
+from prompt_cache import get_prompt_cache
+from request_scheduler import (
+    run_sliding_window, send, record_failures, Hedger, MAX_IN_FLIGHT, HEDGE_ENABLED,
+)
 
 @tenacity.retry(
-    wait=tenacity.wait_exponential(multiplier=1, min=4, max=60),
+    # Jitter so tasks that failed together don't retry in lockstep
+    wait=tenacity.wait_exponential(multiplier=1, min=4, max=60) + tenacity.wait_random(0, 4),
     stop=tenacity.stop_after_attempt(5)
 )
-async def sample_with_retry(sampling_client, minput, num_samples, stop_condition):
-    return await sampling_client.sample_async(
+async def sample_with_retry(client, minput, num_samples, stop_condition,
+                            temperature=1.0, max_tokens=2048, hedger=None):
+    # Each attempt is sent (and, with a hedger, hedged) on its own inside the retry
+    return await send(lambda: client.sample_async(
         minput,
         num_samples=num_samples,
-        sampling_params=tinker.SamplingParams(
-            temperature=1.0,
-            max_tokens=2048,
+        sampling_params=get_backend().sampling_params(
+            temperature=temperature,
+            max_tokens=max_tokens,
             stop=stop_condition,
         )
-    )
+    ), hedger)
 
-async def generate_for_model(model_name_or_id, is_base_model, prompts, output_file, num_samples=10, batch_size=50):
-    client = ServiceClient()
-    
+async def generate_for_model(model_name_or_id, is_base_model, prompts, output_file, num_samples=10, max_in_flight=MAX_IN_FLIGHT,
+                             hedge=HEDGE_ENABLED, prompts_path=None):
+    # Clients, tokenizer and renderer are shared by every model / attack in the process
     if is_base_model:
-        sampling_client = client.create_sampling_client(base_model=model_name_or_id)
+        client = sampling_client(base_model=model_name_or_id)
     else:
-        sampling_client = client.create_sampling_client(model_path=model_name_or_id)
-        
-    tokenizer = get_tokenizer("meta-llama/Llama-3.1-8B-Instruct")
-    renderer = get_renderer("llama3", tokenizer=tokenizer)
+        client = sampling_client(model_path=model_name_or_id)
+    renderer = shared_renderer()
     stop_condition = renderer.get_stop_sequences()
     
     # Check if we already have some done
@@ -57,52 +55,50 @@ async def generate_for_model(model_name_or_id, is_base_model, prompts, output_fi
     
     print(f"Generating for {model_name_or_id}. {len(completed_ids)} already done, {len(remaining_prompts)} remaining.")
     if not remaining_prompts:
+        record_failures(output_file, [])
         return
         
-    out_f = open(output_file, "a")
-    
-    async def process_batch(batch):
-        # build tinker ModelInputs
-        model_inputs = []
-        for p in batch:
-            messages = [{"role": "user", "content": p["prompt_text"]}]
-            model_inputs.append(renderer.build_generation_prompt(messages))
-            
-        # sample
-        tasks = []
-        for minput in model_inputs:
-            tasks.append(
-                sample_with_retry(sampling_client, minput, num_samples, stop_condition)
-            )
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        for p, result in zip(batch, results):
-            if isinstance(result, Exception):
-                print(f"Error on {p['prompt_id']}: {result}")
-                continue
-                
-            generations = []
-            for seq in result.sequences:
-                parsed_message, _ = renderer.parse_response(seq.tokens)
-                generations.append(parsed_message["content"])
-                
-            out_obj = {
-                "prompt_id": p["prompt_id"],
-                "patient_id": p["patient_id"],
-                "split": p["split"],
-                "rarity_group": p["rarity_group"],
-                "generations": generations
-            }
-            out_f.write(json.dumps(out_obj) + "\n")
-            out_f.flush()
+    # Rendered once per prompt text and reused by every model and rerun
+    prompt_cache = get_prompt_cache(prompts_path)
+    inputs = prompt_cache.model_inputs(remaining_prompts)
+    print(f"  {prompt_cache.summary()}")
 
-    for i in range(0, len(remaining_prompts), batch_size):
-        batch = remaining_prompts[i:i+batch_size]
-        print(f"Processing batch {i//batch_size + 1}/{(len(remaining_prompts)-1)//batch_size + 1}...")
-        await process_batch(batch)
-        
-    out_f.close()
+    hedger = Hedger() if hedge else None
+
+    async def sample_prompt(p):
+        minput = inputs[p["prompt_id"]]
+        return await sample_with_retry(client, minput, num_samples, stop_condition, hedger=hedger)
+
+    failures = []
+
+    def write_result(p, result):
+        if isinstance(result, Exception):
+            print(f"Error on {p['prompt_id']}: {result}")
+            failures.append((p, result))
+            return
+
+        generations = []
+        for seq in result.sequences:
+            parsed_message, _ = renderer.parse_response(seq.tokens)
+            generations.append(parsed_message["content"])
+
+        out_obj = {
+            "prompt_id": p["prompt_id"],
+            "patient_id": p["patient_id"],
+            "split": p["split"],
+            "rarity_group": p["rarity_group"],
+            "splits_fingerprint": p.get("splits_fingerprint"),
+            "generations": generations
+        }
+        out_f.write(json.dumps(out_obj) + "\n")
+        out_f.flush()
+
+    # Sliding window: up to max_in_flight requests at once, each written as it completes
+    with open(output_file, "a") as out_f:
+        await run_sliding_window(remaining_prompts, sample_prompt, write_result, max_in_flight)
+    record_failures(output_file, failures)
+    if hedger:
+        print(f"  {hedger.summary()}")
 
 async def main():
     api_key = os.environ.get("TINKER_API_KEY")
@@ -113,17 +109,21 @@ async def main():
         except ImportError:
             pass
             
-    if not api_key:
+    if not api_key and get_backend().name == "tinker":
         print("ERROR: TINKER_API_KEY not found in environment variables or config.py!")
         print("Please export TINKER_API_KEY='your_key' or add it to src/utils/config.py.")
         sys.exit(1)
         
-    os.environ["TINKER_API_KEY"] = api_key
+    os.environ["TINKER_API_KEY"] = api_key or ""
     
-    # Model identifiers
+    # Model identifiers. The phase-1 models were trained before the registry and
+    # no launcher trains them, so their original URIs are registered under these
+    # names on first use (repoint with `model_registry.py add M1_Full tinker://...`)
     M0 = "meta-llama/Llama-3.1-8B-Instruct"
-    M1 = "tinker://9394d193-94dc-59ec-9b51-4eca06ebbc0f:train:0/sampler_weights/final"
-    M2 = "tinker://90476feb-603f-550d-ab72-3560f27ee267:train:0/sampler_weights/final"
+    M1 = resolve_model("M1_Full", register_default=True,
+                       default="tinker://9394d193-94dc-59ec-9b51-4eca06ebbc0f:train:0/sampler_weights/final")
+    M2 = resolve_model("M2_Coarsened", register_default=True,
+                       default="tinker://90476feb-603f-550d-ab72-3560f27ee267:train:0/sampler_weights/final")
     
     # Load prompts
     prompts_path = Path("data/processed/eval_prompts.jsonl")
@@ -140,13 +140,16 @@ async def main():
     out_dir.mkdir(parents=True, exist_ok=True)
     
     print("--- Running M0 (Base Model) ---")
-    await generate_for_model(M0, True, prompts, out_dir / "M0_predictions.jsonl")
+    await generate_for_model(M0, True, prompts, out_dir / "M0_predictions.jsonl",
+                             prompts_path=prompts_path)
     
     print("--- Running M1 (Full SFT) ---")
-    await generate_for_model(M1, False, prompts, out_dir / "M1_predictions.jsonl")
+    await generate_for_model(M1, False, prompts, out_dir / "M1_predictions.jsonl",
+                             prompts_path=prompts_path)
     
     print("--- Running M2 (Coarsened SFT) ---")
-    await generate_for_model(M2, False, prompts, out_dir / "M2_predictions.jsonl")
+    await generate_for_model(M2, False, prompts, out_dir / "M2_predictions.jsonl",
+                             prompts_path=prompts_path)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,474 @@
+"""
+request_scheduler.py
+─────────────────────────────────────────────────────────────────────────────
+Sliding-window scheduler for sampling requests.
+
+The generate scripts used to sample prompts in fixed batches of 50 with
+asyncio.gather, so every batch waited for its slowest request — including
+tenacity backoffs of up to 60 s — while the other 49 slots sat idle.
+
+run_sliding_window() instead keeps up to `max_in_flight` requests running
+at all times: as soon as one finishes, its result is handed to `on_result`
+(e.g. appended to the predictions file) and the next prompt starts.
+
+    async def work(prompt): ...               # one request (with its retries)
+    def save(prompt, result): ...             # result, or the exception it raised
+    await run_sliding_window(prompts, work, save, max_in_flight=50)
+
+Every sampling attempt goes through request_slot(), which applies three
+process-wide controls shared by every model and attack in the process:
+
+    async with request_slot():
+        result = await sampling_client.sample_async(...)
+
+  1. circuit breaker — dispatch pauses while open (see below)
+  2. token bucket    — at most RATE_LIMIT attempts/s, bursts of RATE_BURST
+  3. AIMD limiter    — adaptive cap on concurrent attempts (get_limiter())
+
+Circuit breaker: once at least BREAKER_MIN_SAMPLES of the last
+BREAKER_WINDOW attempts are in and BREAKER_ERROR_RATE of them failed, the
+breaker opens and no attempt is dispatched for BREAKER_OPEN_SECONDS
+(doubling on every consecutive trip, up to BREAKER_MAX_OPEN_SECONDS). It then
+lets BREAKER_PROBES probe attempts through; if they all succeed dispatch
+resumes, otherwise it opens again. Retries wait at the breaker instead of
+failing against a degraded service.
+
+AIMD limiter:
+
+  • success with healthy latency (≤ LATENCY_FACTOR × the rolling median)
+    while the limit is in use → limit += 1/limit, i.e. about +1 per window
+    of requests
+  • rate-limit errors (429 / "rate limit" / "too many requests") and
+    timeouts → limit × BACKOFF, at most once per cool-down so one burst of
+    failures counts as a single congestion signal
+  • other errors and slow successes leave the limit unchanged
+
+The limit stays within [MIN_LIMIT, MAX_LIMIT] and starts at INITIAL_LIMIT
+(the old static concurrency). Retry backoff sleeps happen outside a slot.
+
+Prompts that still fail after their retries are written to
+<predictions>.failed.jsonl (record_failures) instead of being dropped.
+
+Optional hedging (Hedger, HEDGE_REQUESTS=1, via send()): a single attempt
+still running after the p95 attempt latency observed so far gets a
+duplicate; whichever finishes first wins and the other is cancelled.
+Latency is measured from the moment an attempt holds its request_slot(), so
+queueing behind the limiter never triggers a hedge, and hedging sits inside
+the caller's retry loop (one attempt is duplicated, not a whole retry
+sequence). Extra requests are capped at HEDGE_BUDGET
+of all requests, and nothing is hedged until HEDGE_MIN_SAMPLES latencies
+have been seen.
+"""
+
+import os
+import json
+import time
+import asyncio
+import statistics
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+MAX_IN_FLIGHT  = 256    # prompts scheduled at once; the limiter decides how many are sent
+PROGRESS_EVERY = 50     # completed requests between progress lines
+
+# ── AIMD ──────────────────────────────────────────────────────────────────────
+INITIAL_LIMIT  = 50
+MIN_LIMIT      = 2
+MAX_LIMIT      = 256
+BACKOFF        = 0.5
+LATENCY_FACTOR = 3.0    # latency above this × rolling median counts as unhealthy
+LATENCY_WINDOW = 200    # recent successful attempts kept for the median
+MIN_COOLDOWN   = 1.0    # seconds between multiplicative cuts (or the median latency, if longer)
+
+OVERLOAD_MARKERS = ("429", "rate limit", "ratelimit", "too many requests",
+                    "timeout", "timed out", "overloaded", "503")
+
+
+def is_overload(exc):
+    """Rate-limit or timeout errors: the service wants less concurrency."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    text = f"{type(exc).__name__} {exc}".lower()
+    return any(marker in text for marker in OVERLOAD_MARKERS)
+
+
+class AIMDLimiter:
+    """Additive-increase / multiplicative-decrease cap on concurrent sampling attempts."""
+
+    def __init__(self, initial=INITIAL_LIMIT, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT,
+                 backoff=BACKOFF, latency_factor=LATENCY_FACTOR):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.last_cut = 0.0
+        self.n_ok = self.n_overload = self.n_error = self.n_cuts = 0
+        self._cond = None
+        self._loop = None
+
+    def _condition(self):
+        # asyncio primitives belong to one event loop; scripts may call asyncio.run more than once
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._cond, self._loop, self.in_flight = asyncio.Condition(), loop, 0
+        return self._cond
+
+    def median_latency(self):
+        return statistics.median(self.latencies) if self.latencies else None
+
+    def on_success(self, latency):
+        self.n_ok += 1
+        median = self.median_latency()
+        self.latencies.append(latency)
+        saturated = self.in_flight >= int(self.limit) - 1   # don't grow a limit that isn't being used
+        healthy = median is None or len(self.latencies) < 10 or latency <= self.latency_factor * median
+        if saturated and healthy:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_error(self, exc):
+        if not is_overload(exc):
+            self.n_error += 1
+            return
+        self.n_overload += 1
+        now = time.monotonic()
+        if now - self.last_cut >= max(MIN_COOLDOWN, self.median_latency() or 0):
+            old = self.limit
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self.last_cut = now
+            self.n_cuts += 1
+            print(f"  ⚠ {type(exc).__name__}: concurrency {old:.0f} → {self.limit:.0f}")
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one concurrency slot for a single request attempt and record its outcome."""
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            self.on_error(e)
+            raise
+        else:
+            self.on_success(time.monotonic() - start)
+        finally:
+            async with cond:
+                self.in_flight -= 1
+                cond.notify_all()
+
+    def summary(self):
+        return (f"concurrency {self.limit:.0f} (ok {self.n_ok}, rate-limited/timeouts "
+                f"{self.n_overload}, other errors {self.n_error}, {self.n_cuts} cuts)")
+
+
+# ── Rate limit + circuit breaker ──────────────────────────────────────────────
+RATE_LIMIT  = float(os.environ.get("SAMPLING_RATE_LIMIT", 20))   # attempts/s, 0 = unlimited
+RATE_BURST  = 40
+
+BREAKER_WINDOW           = 50
+BREAKER_MIN_SAMPLES      = 20
+BREAKER_ERROR_RATE       = 0.5
+BREAKER_OPEN_SECONDS     = 15.0
+BREAKER_MAX_OPEN_SECONDS = 240.0
+BREAKER_PROBES           = 3
+
+
+class TokenBucket:
+    """Token bucket: `rate` tokens per second, up to `burst` saved."""
+
+    def __init__(self, rate=RATE_LIMIT, burst=RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = None
+        self._loop = None
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lock, self._loop = asyncio.Lock(), loop
+        async with self._lock:   # FIFO: waiters are served in arrival order
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """closed → (error spike) → open → (cool-off) → half-open probes → closed / open."""
+
+    def __init__(self):
+        self.state = "closed"
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)
+        self.open_seconds = BREAKER_OPEN_SECONDS
+        self.reopen_at = 0.0
+        self.probes_left = 0
+        self.probes_ok = 0
+        self.n_trips = 0
+
+    def _trip(self):
+        if self.state == "half-open":
+            self.open_seconds = min(self.open_seconds * 2, BREAKER_MAX_OPEN_SECONDS)
+        self.state = "open"
+        self.n_trips += 1
+        self.reopen_at = time.monotonic() + self.open_seconds
+        self.outcomes.clear()
+        print(f"  ⚠ Circuit breaker open: pausing dispatch for {self.open_seconds:.0f}s")
+
+    async def admit(self):
+        """Wait until an attempt may be dispatched. Returns True if it is a probe."""
+        while True:
+            if self.state == "closed":
+                return False
+            if self.state == "open":
+                wait = self.reopen_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                self.state, self.probes_left, self.probes_ok = "half-open", BREAKER_PROBES, 0
+                print(f"  ▶ Circuit breaker half-open: sending {BREAKER_PROBES} probe request(s)")
+            if self.probes_left > 0:
+                self.probes_left -= 1
+                return True
+            await asyncio.sleep(0.5)
+
+    def record(self, ok, probe):
+        """Outcome of an attempt (ok=None: cancelled, not counted)."""
+        if probe:
+            if ok is None:
+                self.probes_left += 1
+            elif not ok:
+                if self.state == "half-open":   # the first failed probe re-opens it
+                    self._trip()
+            else:
+                self.probes_ok += 1
+                if self.probes_ok >= BREAKER_PROBES and self.state == "half-open":
+                    self.state, self.open_seconds = "closed", BREAKER_OPEN_SECONDS
+                    print("  ✓ Circuit breaker closed: resuming dispatch")
+            return
+        if ok is None or self.state != "closed":
+            return
+        self.outcomes.append(ok)
+        if len(self.outcomes) >= BREAKER_MIN_SAMPLES:
+            error_rate = 1 - sum(self.outcomes) / len(self.outcomes)
+            if error_rate >= BREAKER_ERROR_RATE:
+                self._trip()
+
+    def summary(self):
+        return f"breaker {self.state}, {self.n_trips} trip(s)"
+
+
+# ── Hedging ───────────────────────────────────────────────────────────────────
+HEDGE_ENABLED     = os.environ.get("HEDGE_REQUESTS") == "1"
+HEDGE_QUANTILE    = 0.95
+HEDGE_BUDGET      = 0.05   # extra requests, as a fraction of requests issued
+HEDGE_MIN_SAMPLES = 20
+
+
+class Hedger:
+    """Duplicates requests that outlive the observed p95 latency, within a budget."""
+
+    def __init__(self, quantile=HEDGE_QUANTILE, budget=HEDGE_BUDGET, min_samples=HEDGE_MIN_SAMPLES):
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=LATENCY_WINDOW * 5)
+        self.n_requests = self.n_hedges = self.n_hedge_wins = 0
+
+    def delay(self):
+        if len(self.latencies) < self.min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    def can_hedge(self):
+        return self.n_hedges < self.budget * self.n_requests
+
+    async def run(self, call):
+        """
+        One attempt of `await call()` inside request_slot(), hedged with a
+        second attempt if the first has held its slot past the p95 latency.
+        """
+        self.n_requests += 1
+        in_slot = asyncio.Event()
+        started = {}   # attempt task -> time it entered its slot
+
+        async def attempt(primary):
+            async with request_slot():
+                if primary:
+                    in_slot.set()
+                start = started[asyncio.current_task()] = time.monotonic()
+                result = await call()
+                self.latencies.append(time.monotonic() - start)
+                return result
+
+        primary = asyncio.ensure_future(attempt(True))
+        tasks = [primary]
+        try:
+            # The hedge timer starts once the primary is actually sending
+            waiter = asyncio.ensure_future(in_slot.wait())
+            await asyncio.wait([primary, waiter], return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            delay = self.delay()
+            if delay is not None and not primary.done():
+                await asyncio.wait(tasks, timeout=delay)
+                if not primary.done() and self.can_hedge():
+                    self.n_hedges += 1
+                    tasks.append(asyncio.ensure_future(attempt(False)))
+
+            running = list(tasks)
+            while True:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if t.exception() is None), None)
+                if winner is not None:
+                    break
+                running = [t for t in running if t not in done]
+                if not running:
+                    raise done.pop().exception()
+
+            if winner is not primary:
+                self.n_hedge_wins += 1
+            # Losers are cancelled before they finish, so their latency is censored:
+            # record at least `delay`, else dropping the slow ones biases p95 down
+            now = time.monotonic()
+            for t in tasks:
+                if t is not winner and not t.done() and t in started:
+                    self.latencies.append(max(now - started[t], delay))
+            return winner.result()
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+
+    def summary(self):
+        return (f"hedged {self.n_hedges}/{self.n_requests} requests, "
+                f"{self.n_hedge_wins} finished first")
+
+
+_limiter = None
+_bucket = None
+_breaker = None
+
+
+def get_limiter():
+    """The process-wide limiter shared by every model and attack."""
+    global _limiter
+    if _limiter is None:
+        _limiter = AIMDLimiter()
+    return _limiter
+
+
+def get_bucket():
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket()
+    return _bucket
+
+
+def get_breaker():
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker()
+    return _breaker
+
+
+@asynccontextmanager
+async def request_slot():
+    """Breaker, rate limit and concurrency limit for one sampling attempt."""
+    breaker = get_breaker()
+    probe = await breaker.admit()
+    ok = None
+    try:
+        await get_bucket().acquire()
+        async with get_limiter().slot():
+            try:
+                yield
+            except Exception:
+                ok = False
+                raise
+            ok = True
+    finally:
+        breaker.record(ok, probe)
+
+
+async def send(call, hedger=None):
+    """One sampling attempt: `await call()` inside request_slot(), hedged if a Hedger is given."""
+    if hedger is not None:
+        return await hedger.run(call)
+    async with request_slot():
+        return await call()
+
+
+def failures_path(output_file):
+    return f"{str(output_file).rsplit('.jsonl', 1)[0]}.failed.jsonl"
+
+
+def record_failures(output_file, failures):
+    """
+    Write the prompts that failed in this run next to the predictions file
+    (<name>.failed.jsonl: prompt_id, error, time); removed once none fail.
+    Failed prompts are not in the predictions file, so a re-run retries them.
+    """
+    path = failures_path(output_file)
+    if not failures:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    now = datetime.now().isoformat(timespec="seconds")
+    with open(path, "w") as f:
+        for p, exc in failures:
+            f.write(json.dumps({"prompt_id": p["prompt_id"], "error": repr(exc), "time": now}) + "\n")
+    print(f"  ⚠ {len(failures)} prompt(s) failed → {path} (re-run to retry them)")
+
+
+async def run_sliding_window(items, worker, on_result, max_in_flight=MAX_IN_FLIGHT,
+                             progress_every=PROGRESS_EVERY):
+    """
+    Run `await worker(item)` for every item with at most max_in_flight in
+    flight. on_result(item, result) is called in completion order from this
+    coroutine (so it may write files without locking); result is the
+    exception if the worker raised. Returns the number of failed items.
+    """
+    total = len(items) if hasattr(items, "__len__") else None
+    items = iter(items)
+    pending = {}
+    n_done = n_failed = 0
+    start = time.monotonic()
+
+    def fill():
+        while len(pending) < max_in_flight:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            pending[asyncio.ensure_future(worker(item))] = item
+
+    fill()
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            item = pending.pop(task)
+            exc = task.exception()
+            if exc is not None:
+                n_failed += 1
+            on_result(item, exc if exc is not None else task.result())
+            n_done += 1
+            if progress_every and n_done % progress_every == 0:
+                rate = n_done / max(time.monotonic() - start, 1e-9)
+                of = f"/{total}" if total is not None else ""
+                print(f"  {n_done}{of} done ({rate:.1f}/s, {get_limiter().summary()}, {get_breaker().summary()})")
+        fill()
+    return n_failed
@@ -0,0 +1,117 @@
+"""
+dataset_manifest.py
+─────────────────────────────────────────────────────────────────────────────
+Virtual training datasets: a base JSONL file plus injected records, stored
+as a small manifest instead of a full copy of the combined file.
+
+Manifest (JSON):
+  base_file      path of the base training JSONL (e.g. tinker_train_M1_full.jsonl)
+  base_sha256    hash of base_file when the manifest was written
+  base_count     number of records in base_file
+  records        distinct injected records (e.g. canary conversations)
+  copies         injected slot -> index into `records`; slot k is item base_count + k
+  order          permutation of range(base_count + len(copies)), or null for identity
+
+The combined dataset is `[base..., records[c] for c in copies]` read in
+`order`. `iter_manifest_records` streams it by seeking into the base file,
+so it never holds the base corpus in memory; `materialize_manifest` writes it
+out only when a training job actually needs a file on disk.
+"""
+
+import os
+import json
+import random
+
+from fingerprint import sha256_file
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def count_lines(path):
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def shuffled_order(n_items, seed):
+    """The permutation `random.shuffle` applies to a list of n_items after random.seed(seed)."""
+    order = list(range(n_items))
+    random.seed(seed)
+    random.shuffle(order)
+    return order
+
+
+def write_manifest(path, base_file, records, copies, order=None, **extra):
+    """Write a manifest describing base_file + injected copies of `records`."""
+    manifest = {
+        "base_file":   os.path.abspath(base_file),
+        "base_sha256": sha256_file(base_file),
+        "base_count":  count_lines(base_file),
+        "records":     records,
+        "copies":      list(copies),
+        "order":       order,
+        **extra,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def load_manifest(path, verify=True):
+    with open(path) as f:
+        manifest = json.load(f)
+    if verify and sha256_file(manifest["base_file"]) != manifest["base_sha256"]:
+        raise ValueError(f"Base file {manifest['base_file']} changed since {path} was written")
+    return manifest
+
+
+def manifest_size(manifest):
+    return manifest["base_count"] + len(manifest["copies"])
+
+
+def line_offsets(path):
+    """Byte offset of every non-blank line in a JSONL file."""
+    offsets = []
+    pos = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.strip():
+                offsets.append(pos)
+            pos += len(line)
+    return offsets
+
+
+def iter_manifest_records(manifest):
+    """Yield the combined records of a manifest (dict or path) in training order."""
+    if isinstance(manifest, str):
+        manifest = load_manifest(manifest)
+
+    base_count = manifest["base_count"]
+    records = manifest["records"]
+    copies = manifest["copies"]
+    order = manifest["order"]
+    if order is None:
+        order = range(base_count + len(copies))
+
+    offsets = line_offsets(manifest["base_file"])
+    if len(offsets) != base_count:
+        raise ValueError(f"Base file has {len(offsets)} records, manifest expects {base_count}")
+
+    with open(manifest["base_file"], "rb") as base:
+        for item in order:
+            if item < base_count:
+                base.seek(offsets[item])
+                yield json.loads(base.readline())
+            else:
+                yield records[copies[item - base_count]]
+
+
+def materialize_manifest(manifest_path, out_path):
+    """Write the combined dataset to out_path (JSONL). Returns the record count."""
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    n = 0
+    with open(out_path, "w") as f:
+        for rec in iter_manifest_records(manifest_path):
+            f.write(json.dumps(rec) + "\n")
+            n += 1
+    return n
@@ -0,0 +1,43 @@
+"""
+fingerprint.py
+─────────────────────────────────────────────────────────────────────────────
+Content hashing helpers shared by the pipeline stages.
+
+A fingerprint is a SHA-256 hex digest over file bytes and/or a canonical
+JSON encoding of parameters, so the same inputs always hash the same no
+matter which script computes them.
+"""
+
+import hashlib
+import inspect
+import json
+
+_CHUNK = 1 << 20
+
+
+def sha256_file(path):
+    """SHA-256 of a file's bytes, read in 1 MiB chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def sha256_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sha256_json(obj):
+    """SHA-256 of a canonical (sorted-key, compact) JSON encoding of obj."""
+    return sha256_text(json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str))
+
+
+def source_fingerprint(*objs):
+    """SHA-256 over the source code of functions/classes, so logic changes invalidate caches."""
+    return sha256_text("\n".join(inspect.getsource(o) for o in objs))
+
+
+def fingerprint(**parts):
+    """Combine named components (digests, params, ...) into one fingerprint."""
+    return sha256_json(parts)
@@ -0,0 +1,326 @@
+"""
+model_registry.py
+─────────────────────────────────────────────────────────────────────────────
+Local SQLite registry of training runs and their Tinker checkpoints.
+
+Replaces copy-pasting tinker:// URIs between training and evaluation:
+job_orchestrator registers every run when it starts and syncs the run's
+checkpoints.jsonl while it trains, so generation scripts can resolve a
+model by its logical (run) name:
+
+    from model_registry import resolve_model
+    M1 = resolve_model("M1_Exact_Age_12_Epochs")
+
+Tables
+  runs         name | dataset_path | dataset_sha256 | base_model | hyperparams (JSON)
+               | fingerprint | log_path | status | sampler_path | created | updated
+  checkpoints  run_name | name | sampler_path | state_path | entry (raw JSON) | recorded
+
+`sampler_path` on a run is the last sampler_path seen in its checkpoints.jsonl
+(the final weights once the run is done). Models trained outside the
+orchestrator can be added with `register_model(name, sampler_path)`.
+
+`fingerprint` identifies what a run trained: the SHA-256 of its dataset
+content, base model and hyperparameters (training_fingerprint). A finished
+run with the same fingerprint as a new job is the same model, so the
+orchestrator reuses it (find_by_fingerprint) instead of training again.
+
+Default database: data/processed/model_registry.sqlite
+(override with the MODEL_REGISTRY_PATH environment variable).
+
+Run:
+  python src/utils/model_registry.py list
+  python src/utils/model_registry.py resolve M1_Exact_Age_12_Epochs
+  python src/utils/model_registry.py sync            # re-read every run's checkpoints.jsonl
+  python src/utils/model_registry.py add NAME tinker://...
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import PROCESSED_DIR
+from fingerprint import fingerprint
+
+REGISTRY_PATH = os.environ.get("MODEL_REGISTRY_PATH",
+                               os.path.join(PROCESSED_DIR, "model_registry.sqlite"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    name            TEXT PRIMARY KEY,
+    dataset_path    TEXT,
+    dataset_sha256  TEXT,
+    base_model      TEXT,
+    hyperparams     TEXT,
+    fingerprint     TEXT,
+    log_path        TEXT,
+    status          TEXT,
+    sampler_path    TEXT,
+    created         TEXT,
+    updated         TEXT
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run_name        TEXT NOT NULL REFERENCES runs(name),
+    name            TEXT,
+    sampler_path    TEXT,
+    state_path      TEXT,
+    entry           TEXT,
+    recorded        TEXT,
+    UNIQUE (run_name, entry)
+);
+"""
+INDEXES = "CREATE INDEX IF NOT EXISTS runs_fingerprint ON runs (fingerprint);"
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def connect(db_path=None):
+    db_path = db_path or REGISTRY_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    _migrate(conn)
+    conn.executescript(INDEXES)
+    return conn
+
+
+def _migrate(conn):
+    """Add the fingerprint column to registries created before it existed."""
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(runs)")}
+    if "fingerprint" in columns:
+        return
+    with conn:
+        conn.execute("ALTER TABLE runs ADD COLUMN fingerprint TEXT")
+        rows = conn.execute("SELECT name, dataset_sha256, base_model, hyperparams FROM runs "
+                            "WHERE dataset_sha256 IS NOT NULL").fetchall()
+        for r in rows:
+            fp = training_fingerprint(r["dataset_sha256"], r["base_model"],
+                                      json.loads(r["hyperparams"] or "{}"))
+            conn.execute("UPDATE runs SET fingerprint=? WHERE name=?", (fp, r["name"]))
+
+
+def training_fingerprint(dataset_sha256, base_model, hyperparams):
+    """What a training run produces is determined by its data, base model and hyperparameters."""
+    return fingerprint(dataset_sha256=dataset_sha256, base_model=base_model,
+                       hyperparams=hyperparams or {})
+
+
+@contextmanager
+def _db(db_path=None):
+    """Connection that commits on success and is always closed."""
+    conn = connect(db_path)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def register_run(name, dataset_path=None, dataset_sha256=None, base_model=None,
+                 hyperparams=None, log_path=None, status="pending", db_path=None):
+    """Insert or update a run. Existing checkpoints and sampler_path are kept."""
+    fp = training_fingerprint(dataset_sha256, base_model, hyperparams) if dataset_sha256 else None
+    with _db(db_path) as conn:
+        conn.execute(
+            """INSERT INTO runs (name, dataset_path, dataset_sha256, base_model, hyperparams,
+                                 fingerprint, log_path, status, created, updated)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET
+                   dataset_path=excluded.dataset_path, dataset_sha256=excluded.dataset_sha256,
+                   base_model=excluded.base_model, hyperparams=excluded.hyperparams,
+                   fingerprint=excluded.fingerprint,
+                   log_path=excluded.log_path, status=excluded.status, updated=excluded.updated""",
+            (name, dataset_path, dataset_sha256, base_model,
+             json.dumps(hyperparams or {}, sort_keys=True), fp, log_path, status, _now(), _now()),
+        )
+
+
+def register_model(name, sampler_path, db_path=None, **fields):
+    """Record a finished model (e.g. trained before the registry existed)."""
+    register_run(name, status="done", db_path=db_path, **fields)
+    with _db(db_path) as conn:
+        conn.execute("UPDATE runs SET sampler_path=?, updated=? WHERE name=?",
+                     (sampler_path, _now(), name))
+
+
+def set_status(name, status, db_path=None):
+    with _db(db_path) as conn:
+        conn.execute("UPDATE runs SET status=?, updated=? WHERE name=?", (status, _now(), name))
+
+
+def read_checkpoint_log(log_path):
+    """Entries of <log_path>/checkpoints.jsonl (malformed lines skipped)."""
+    checkpoints_file = os.path.join(log_path, "checkpoints.jsonl")
+    if not os.path.exists(checkpoints_file):
+        return []
+    entries = []
+    with open(checkpoints_file, "r") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return entries
+
+
+def sync_checkpoints(name, log_path=None, db_path=None):
+    """Copy new checkpoints.jsonl entries into the registry. Returns the run's sampler_path."""
+    with _db(db_path) as conn:
+        row = conn.execute("SELECT log_path, sampler_path FROM runs WHERE name=?", (name,)).fetchone()
+        if row is None:
+            return None
+        log_path = log_path or row["log_path"]
+        sampler_path = row["sampler_path"]
+        if not log_path:
+            return sampler_path
+
+        for entry in read_checkpoint_log(log_path):
+            conn.execute(
+                """INSERT OR IGNORE INTO checkpoints
+                   (run_name, name, sampler_path, state_path, entry, recorded)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (name, entry.get("name"), entry.get("sampler_path"), entry.get("state_path"),
+                 json.dumps(entry), _now()),
+            )
+            # Tinker LoRA inference requires the sampler_weights path, not weights path
+            # (stub:// paths come from the offline backend, see tinker_backend.py)
+            if "://" in (entry.get("sampler_path") or ""):
+                sampler_path = entry["sampler_path"]
+
+        conn.execute("UPDATE runs SET sampler_path=?, updated=? WHERE name=?",
+                     (sampler_path, _now(), name))
+        return sampler_path
+
+
+def find_by_fingerprint(fp, scheme=None, db_path=None):
+    """
+    The most recent finished run with this training fingerprint and a
+    sampler_path, or None. With `scheme` (e.g. "tinker://") only runs whose
+    sampler_path came from that backend match, so a stub:// model is never
+    reused for a real run.
+    """
+    with _db(db_path) as conn:
+        row = conn.execute(
+            """SELECT name FROM runs
+               WHERE fingerprint=? AND status='done' AND sampler_path IS NOT NULL
+                     AND sampler_path LIKE ?
+               ORDER BY updated DESC LIMIT 1""", (fp, f"{scheme or ''}%")).fetchone()
+    return get_run(row["name"], db_path) if row else None
+
+
+def archive_run(name, db_path=None):
+    """
+    Move a run (and its checkpoints and log directory) to
+    `<name>@<fingerprint[:12]>` (`.2`, `.3`, ... if that is taken) so a new run
+    can take over the name without losing the old model. Returns the new name.
+    """
+    run = get_run(name, db_path)
+    if run is None:
+        return None
+    log_path = run["log_path"]
+    has_dir = bool(log_path) and os.path.isdir(log_path)
+    # Same run trained and archived before: add a counter instead of overwriting that archive
+    suffix = f"@{(run['fingerprint'] or 'unknown')[:12]}"
+    n = 1
+    while get_run(f"{name}{suffix}", db_path) or (has_dir and os.path.exists(f"{log_path}{suffix}")):
+        n += 1
+        suffix = f"@{(run['fingerprint'] or 'unknown')[:12]}.{n}"
+    new_name = f"{name}{suffix}"
+    if has_dir:
+        os.rename(log_path, f"{log_path}{suffix}")
+        log_path = f"{log_path}{suffix}"
+    with _db(db_path) as conn:
+        conn.execute("UPDATE runs SET name=?, log_path=?, updated=? WHERE name=?",
+                     (new_name, log_path, _now(), name))
+        conn.execute("UPDATE checkpoints SET run_name=? WHERE run_name=?", (new_name, name))
+    return new_name
+
+
+def get_run(name, db_path=None):
+    with _db(db_path) as conn:
+        row = conn.execute("SELECT * FROM runs WHERE name=?", (name,)).fetchone()
+    if row is None:
+        return None
+    run = dict(row)
+    run["hyperparams"] = json.loads(run["hyperparams"] or "{}")
+    return run
+
+
+def list_runs(db_path=None):
+    with _db(db_path) as conn:
+        return [dict(r) for r in conn.execute("SELECT * FROM runs ORDER BY created")]
+
+
+def list_checkpoints(name, db_path=None):
+    with _db(db_path) as conn:
+        return [dict(r) for r in conn.execute(
+            "SELECT * FROM checkpoints WHERE run_name=? ORDER BY rowid", (name,))]
+
+
+def resolve_model(name, default=None, register_default=False, db_path=None):
+    """
+    Final sampler_path of a finished run, picking up checkpoints written
+    since the last sync. Falls back to `default` if the run is unknown, not
+    done (still training or failed — its latest checkpoint is not the final
+    model) or has no sampler checkpoint.
+
+    With register_default, an unknown name is registered as `default` (for
+    models trained before the registry), so `model_registry.py add NAME URI`
+    can repoint it later.
+    """
+    sampler_path = sync_checkpoints(name, db_path=db_path)
+    run = get_run(name, db_path)
+    if run is None:
+        if register_default and default:
+            register_model(name, default, db_path=db_path)
+        return default
+    if run["status"] != "done":
+        print(f"⚠ {name} is {run['status'] or 'not finished'} — using "
+              f"{default or 'no model'} instead of its latest checkpoint")
+        return default
+    return sampler_path or default
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    sub.add_parser("sync")
+    p_resolve = sub.add_parser("resolve")
+    p_resolve.add_argument("name")
+    p_add = sub.add_parser("add")
+    p_add.add_argument("name")
+    p_add.add_argument("sampler_path")
+    args = parser.parse_args()
+
+    if args.cmd == "add":
+        register_model(args.name, args.sampler_path)
+        print(f"✓ Registered {args.name} → {args.sampler_path}")
+    elif args.cmd == "resolve":
+        path = resolve_model(args.name)
+        if path is None:
+            print(f"ERROR: no finished model with a sampler_path registered for {args.name}")
+            sys.exit(1)
+        print(path)
+    else:
+        runs = list_runs()
+        if args.cmd == "sync":
+            for run in runs:
+                sync_checkpoints(run["name"])
+            runs = list_runs()
+        print(f"{len(runs)} run(s) in {REGISTRY_PATH}")
+        for run in runs:
+            n_ckpt = len(list_checkpoints(run["name"]))
+            print(f"  {run['name']:<32} {run['status'] or '-':<8} ckpts={n_ckpt:<3} "
+                  f"{run['sampler_path'] or '(no sampler yet)'}")
+
+
+if __name__ == "__main__":
+    main()
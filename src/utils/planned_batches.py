@@ -0,0 +1,59 @@
+"""
+planned_batches.py
+─────────────────────────────────────────────────────────────────────────────
+tinker_cookbook dataset builder that trains on the batch plan written by
+prepare_tinker_data.py --batching (see 03_tinker_tuning/batching.py).
+
+FromConversationFileBuilder shuffles records and cuts fixed batches, which
+undoes length bucketing. PlannedBatchesBuilder keeps the planned batches
+intact — bucketed batches of similar-length records, or max_length packs —
+and only shuffles the order of whole batches each epoch. Every record is
+still its own Datum (no concatenation), so attention never crosses records.
+In packed mode batches vary in size (records per pack) and are bounded by
+max_length tokens instead of batch_size records.
+
+Only imported by TinkerBackend.make_train_config (needs tinker_cookbook).
+"""
+
+import json
+import random
+
+import chz
+from tinker_cookbook.supervised.data import conversation_to_datum
+from tinker_cookbook.supervised.types import ChatDatasetBuilder, SupervisedDataset
+
+
+class PlannedBatchDataset(SupervisedDataset):
+    def __init__(self, conversations, batches, to_datum):
+        self.conversations = conversations
+        self.batches = batches
+        self.to_datum = to_datum
+        self.order = list(range(len(batches)))
+
+    def set_epoch(self, seed=0):
+        self.order = list(range(len(self.batches)))
+        random.Random(seed).shuffle(self.order)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def get_batch(self, index):
+        return [self.to_datum(self.conversations[i]) for i in self.batches[self.order[index]]]
+
+
+@chz.chz
+class PlannedBatchesBuilder(ChatDatasetBuilder):
+    file_path: str
+    plan_path: str
+
+    def __call__(self):
+        with open(self.file_path, "r", encoding="utf-8") as f:
+            conversations = [json.loads(line)["messages"] for line in f if line.strip()]
+        with open(self.plan_path) as f:
+            batches = json.load(f)["batches"]
+
+        def to_datum(messages):
+            return conversation_to_datum(messages, self.renderer, self.common_config.max_length,
+                                         self.common_config.train_on_what)
+
+        return PlannedBatchDataset(conversations, batches, to_datum), None
@@ -0,0 +1,102 @@
+"""
+prompt_cache.py
+─────────────────────────────────────────────────────────────────────────────
+Rendered + tokenized generation prompts, shared by every model and rerun.
+
+M0, M1 and M2 (and every checkpoint the watcher evaluates) see the same
+prompt text through the same Llama-3.1 renderer, so the ModelInput for a
+prompt only has to be built once. Entries are keyed by the SHA-256 of the
+prompt text, the renderer name and the tokenizer name, and persisted next
+to the prompt file:
+
+  data/processed/eval_prompts.jsonl
+  data/processed/eval_prompts.rendered.llama3.Llama-3.1-8B-Instruct.jsonl
+      {"sha256": ..., "tokens": [...]}   one line per distinct prompt text
+
+Later models and reruns rebuild inputs with backend.model_input_from_ints
+instead of rendering again. Only backends whose token ids are stable across
+processes (stable_token_ids; not the stub) write the file — otherwise the
+cache is kept in memory for the process.
+
+    cache = get_prompt_cache("data/processed/eval_prompts.jsonl")
+    inputs = cache.model_inputs(prompts)        # prompt_id -> ModelInput
+"""
+
+import os
+import json
+
+from fingerprint import sha256_text
+from tinker_backend import get_backend, shared_renderer, BASE_MODEL, RENDERER_NAME
+
+_caches = {}
+
+
+def prompt_messages(prompt_text):
+    return [{"role": "user", "content": prompt_text}]
+
+
+def cache_path(prompts_path, renderer_name=RENDERER_NAME, model_name=BASE_MODEL):
+    base = str(prompts_path).rsplit(".jsonl", 1)[0]
+    return f"{base}.rendered.{renderer_name}.{model_name.split('/')[-1]}.jsonl"
+
+
+class PromptCache:
+    """ModelInputs keyed by (sha256 of prompt text, renderer, tokenizer)."""
+
+    def __init__(self, prompts_path=None, model_name=BASE_MODEL, renderer_name=RENDERER_NAME):
+        self.backend = get_backend()
+        self.renderer = shared_renderer(model_name, renderer_name)
+        self.path = None
+        if prompts_path is not None and self.backend.stable_token_ids:
+            self.path = cache_path(prompts_path, renderer_name, model_name)
+        self.tokens = self._load()
+        self.inputs = {}
+        self.n_rendered = 0
+
+    def _load(self):
+        tokens = {}
+        if not self.path or not os.path.exists(self.path):
+            return tokens
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue   # partial line from an interrupted write
+                tokens[entry["sha256"]] = entry["tokens"]
+        return tokens
+
+    def model_inputs(self, prompts):
+        """{prompt_id: ModelInput} for prompt records, rendering only texts not seen before."""
+        inputs, new = {}, []
+        for p in prompts:
+            key = sha256_text(p["prompt_text"])
+            if key not in self.inputs:
+                if key in self.tokens:
+                    self.inputs[key] = self.backend.model_input_from_ints(self.tokens[key])
+                else:
+                    minput = self.renderer.build_generation_prompt(prompt_messages(p["prompt_text"]))
+                    self.inputs[key] = minput
+                    self.tokens[key] = minput.to_ints()
+                    new.append(key)
+            inputs[p["prompt_id"]] = self.inputs[key]
+        self.n_rendered += len(new)
+        if new and self.path:
+            with open(self.path, "a") as f:
+                for key in new:
+                    f.write(json.dumps({"sha256": key, "tokens": self.tokens[key]}) + "\n")
+        return inputs
+
+    def summary(self):
+        where = self.path or "memory only"
+        return (f"prompt cache: {len(self.tokens)} prompt(s), "
+                f"{self.n_rendered} rendered by this process ({where})")
+
+
+def get_prompt_cache(prompts_path=None, model_name=BASE_MODEL, renderer_name=RENDERER_NAME):
+    """Process-wide cache for a prompt file (None: in-memory cache for ad-hoc prompt lists)."""
+    key = (get_backend().name, os.path.abspath(prompts_path) if prompts_path else None,
+           model_name, renderer_name)
+    if key not in _caches:
+        _caches[key] = PromptCache(prompts_path, model_name, renderer_name)
+    return _caches[key]
@@ -0,0 +1,127 @@
+"""
+splits_cache.py
+─────────────────────────────────────────────────────────────────────────────
+Fingerprinted cache for the rarity scores and train/test split.
+
+splits.csv is keyed by a fingerprint of
+  • the raw cohort CSV (file bytes),
+  • the rarity definition: profile functions, code maps, k / quantile
+    thresholds and split parameters (see create_splits_and_prompts.rarity_definition).
+
+create_splits_and_prompts.py reuses data/processed/cache/splits_<fp>.csv when
+the fingerprint is unchanged, and writes a sidecar next to splits.csv:
+
+  splits.csv.fingerprint.json
+    fingerprint | splits_sha256 | created
+
+Downstream scripts call `load_splits()` instead of `pd.read_csv(OUT_SPLITS_PATH)`.
+It refuses a splits.csv that was edited by hand, has no sidecar, or no longer
+matches the current raw data / rarity definition. Set ALLOW_STALE_SPLITS=1 to
+downgrade the refusal to a warning (e.g. when re-analysing archived results).
+"""
+
+import os
+import sys
+import json
+import shutil
+from datetime import datetime
+
+import pandas as pd
+
+from config import CSV_PATH, PROCESSED_DIR, OUT_SPLITS_PATH
+from fingerprint import fingerprint, sha256_file
+
+SPLITS_CACHE_DIR = os.path.join(PROCESSED_DIR, "cache")
+RARITY_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '02_rarity_analysis'))
+
+
+def meta_path(splits_path=OUT_SPLITS_PATH):
+    return f"{splits_path}.fingerprint.json"
+
+
+def cached_path(fp, name="splits"):
+    return os.path.join(SPLITS_CACHE_DIR, f"{name}_{fp[:16]}.csv")
+
+
+def splits_fingerprint(csv_path, definition):
+    return fingerprint(data=sha256_file(csv_path), definition=definition)
+
+
+def current_splits_fingerprint():
+    """Fingerprint of the live raw CSV + rarity definition, or None if the raw CSV is absent."""
+    if not os.path.exists(CSV_PATH):
+        return None
+    if RARITY_DIR not in sys.path:
+        sys.path.append(RARITY_DIR)
+    from create_splits_and_prompts import rarity_definition
+    return splits_fingerprint(CSV_PATH, rarity_definition())
+
+
+def read_meta(splits_path=OUT_SPLITS_PATH):
+    path = meta_path(splits_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def publish_splits(src_path, fp, splits_path=OUT_SPLITS_PATH):
+    """Copy a cached splits file to splits_path and write its fingerprint sidecar."""
+    if os.path.abspath(src_path) != os.path.abspath(splits_path):
+        shutil.copyfile(src_path, splits_path)
+    meta = {
+        "fingerprint":   fp,
+        "splits_sha256": sha256_file(splits_path),
+        "created":       datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(meta_path(splits_path), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def check_splits(splits_path=OUT_SPLITS_PATH):
+    """Return (fingerprint, problem). problem is None when splits_path is fresh."""
+    if not os.path.exists(splits_path):
+        return None, f"{splits_path} does not exist"
+    meta = read_meta(splits_path)
+    if meta is None:
+        return None, f"{splits_path} has no fingerprint sidecar (written before caching was added?)"
+    if sha256_file(splits_path) != meta["splits_sha256"]:
+        return meta["fingerprint"], f"{splits_path} was modified after it was generated"
+    current = current_splits_fingerprint()
+    if current is not None and current != meta["fingerprint"]:
+        return meta["fingerprint"], "raw data or rarity definition changed since splits.csv was generated"
+    return meta["fingerprint"], None
+
+
+def load_splits(splits_path=OUT_SPLITS_PATH):
+    """Read splits.csv after validating its fingerprint. Returns (df_splits, fingerprint)."""
+    fp, problem = check_splits(splits_path)
+    if problem:
+        if os.environ.get("ALLOW_STALE_SPLITS") == "1":
+            print(f"WARNING: {problem} (continuing because ALLOW_STALE_SPLITS=1)")
+        else:
+            print(f"ERROR: {problem}.")
+            print("Re-run src/02_rarity_analysis/create_splits_and_prompts.py, or set ALLOW_STALE_SPLITS=1.")
+            sys.exit(1)
+    return pd.read_csv(splits_path), fp
+
+
+def check_record_fingerprints(records, label, splits_path=OUT_SPLITS_PATH):
+    """
+    Warn when prompt / prediction records carry split labels from a different splits.csv.
+
+    Returns the number of mismatching records. Records without a
+    `splits_fingerprint` field (built before fingerprinting) are counted separately.
+    """
+    meta = read_meta(splits_path)
+    if meta is None:
+        print(f"WARNING: cannot verify split labels in {label}: no fingerprint for {splits_path}")
+        return 0
+    stamped = [r.get("splits_fingerprint") for r in records]
+    n_missing = sum(fp is None for fp in stamped)
+    n_stale = sum(fp is not None and fp != meta["fingerprint"] for fp in stamped)
+    if n_stale:
+        print(f"WARNING: {n_stale}/{len(records)} records in {label} were built against a different splits.csv")
+    if n_missing:
+        print(f"WARNING: {n_missing}/{len(records)} records in {label} carry no splits fingerprint")
+    return n_stale
@@ -0,0 +1,395 @@
+"""
+tinker_backend.py
+─────────────────────────────────────────────────────────────────────────────
+Pluggable backend for everything stages 03–04 need from Tinker: service /
+sampling clients, sampling params, tokenizer + renderer, and SFT training.
+
+  tinker  the real service (tinker + tinker_cookbook), imported lazily
+  stub    fully local: simulated sample_async with configurable latency,
+          error rate and templated card outputs; simulated train.main that
+          writes a checkpoints.jsonl per epoch. For load-testing the
+          concurrency / retry / resume logic without spending quota.
+
+Select with the TINKER_BACKEND environment variable (default: tinker):
+
+  TINKER_BACKEND=stub python src/04_evaluation/generation/generate_predictions.py
+
+Stub knobs (environment):
+  TINKER_STUB_LATENCY        mean seconds per sample_async call     (0.5)
+  TINKER_STUB_ERROR_RATE     probability a call raises              (0.05)
+  TINKER_STUB_CAPACITY       concurrent calls before 429s, 0 = none (0)
+  TINKER_STUB_EPOCH_SECONDS  simulated seconds per training epoch   (1.0)
+  TINKER_STUB_SEED           RNG seed                               (0)
+
+Scripts call `get_backend()` and use only the methods below, so both
+backends are interchangeable:
+
+  backend.service_client()                        .create_sampling_client(model_path= | base_model=)
+  backend.sampling_params(**kw)
+  backend.tokenizer(model_name) / backend.renderer(tokenizer)
+  backend.model_input_from_ints(tokens)
+  backend.make_train_config(...) / backend.check_log_dir(path, resume=) / await backend.train(config)
+
+Loading the tokenizer is one of the largest fixed costs of a generation
+stage, so scripts that sample take their resources from the process-wide
+cache instead of building their own per model / attack:
+
+  shared_tokenizer(model_name) / shared_renderer(model_name)   loaded once per process
+  shared_service_client()                                      one ServiceClient
+  sampling_client(model_path= | base_model=)                   pooled by model URI
+"""
+
+import os
+import sys
+import json
+import random
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+COOKBOOK_PATH = os.path.expanduser("~/tinker/tinker-cookbook")
+BACKEND_ENV = "TINKER_BACKEND"
+
+BASE_MODEL = "meta-llama/Llama-3.1-8B-Instruct"
+RENDERER_NAME = "llama3"
+
+_backends = {}
+_resources = {}   # (backend name, kind, *key) -> tokenizer / renderer / client
+
+
+# ── Real service ──────────────────────────────────────────────────────────────
+
+class TinkerBackend:
+    name = "tinker"
+    sampler_scheme = "tinker://"
+    stable_token_ids = True    # token ids can be persisted (see prompt_cache.py)
+
+    def __init__(self):
+        if COOKBOOK_PATH not in sys.path:
+            sys.path.append(COOKBOOK_PATH)
+        import tinker
+        self._tinker = tinker
+
+    def service_client(self):
+        from tinker.lib.public_interfaces.service_client import ServiceClient
+        return ServiceClient()
+
+    def sampling_params(self, **kwargs):
+        return self._tinker.SamplingParams(**kwargs)
+
+    def model_input_from_ints(self, tokens):
+        return self._tinker.ModelInput.from_ints(tokens)
+
+    def tokenizer(self, model_name):
+        from tinker_cookbook.tokenizer_utils import get_tokenizer
+        return get_tokenizer(model_name)
+
+    def renderer(self, tokenizer, name="llama3"):
+        from tinker_cookbook.renderers import get_renderer
+        return get_renderer(name, tokenizer=tokenizer)
+
+    def make_train_config(self, dataset_path, log_path, model_name, epochs,
+                          learning_rate, lr_schedule, max_length, batch_size,
+                          lora_rank=32, eval_every=10, batch_plan=None):
+        import chz
+        from tinker_cookbook import model_info
+        from tinker_cookbook.renderers import TrainOnWhat
+        from tinker_cookbook.supervised import train
+        from tinker_cookbook.supervised.data import FromConversationFileBuilder
+        from tinker_cookbook.supervised.types import ChatDatasetBuilderCommonConfig
+
+        common_config = ChatDatasetBuilderCommonConfig(
+            model_name_for_tokenizer=model_name,
+            renderer_name=model_info.get_recommended_renderer_name(model_name),
+            max_length=max_length,
+            batch_size=batch_size,
+            train_on_what=TrainOnWhat.ALL_ASSISTANT_MESSAGES,
+        )
+        if batch_plan:
+            # Bucketed / packed batches from prepare_tinker_data.py --batching
+            from planned_batches import PlannedBatchesBuilder
+            dataset = PlannedBatchesBuilder(common_config=common_config, file_path=dataset_path,
+                                            plan_path=batch_plan)
+        else:
+            dataset = FromConversationFileBuilder(common_config=common_config, file_path=dataset_path)
+        blueprint = chz.Blueprint(train.Config).apply({
+            "log_path":        log_path,
+            "model_name":      model_name,
+            "dataset_builder": dataset,
+            "learning_rate":   learning_rate,
+            "lr_schedule":     lr_schedule,
+            "num_epochs":      epochs,
+            "lora_rank":       lora_rank,
+            "eval_every":      eval_every,
+        })
+        return blueprint.make()
+
+    def check_log_dir(self, log_path, resume=False):
+        # On resume, train.main restarts from the last state_path in checkpoints.jsonl
+        from tinker_cookbook import cli_utils
+        cli_utils.check_log_dir(log_path, behavior_if_exists="resume" if resume else "delete")
+
+    async def train(self, config):
+        from tinker_cookbook.supervised import train
+        await train.main(config)
+
+
+# ── Local stub ────────────────────────────────────────────────────────────────
+
+class StubServiceError(RuntimeError):
+    """Simulated transient service failure."""
+
+
+class StubRateLimitError(StubServiceError):
+    """Simulated 429 when more than TINKER_STUB_CAPACITY calls are in flight."""
+
+
+class StubTokenizer:
+    """Whitespace tokenizer with a growing vocabulary (ids are stable within a process)."""
+
+    def __init__(self):
+        self.vocab = {}
+        self.inverse = []
+
+    def encode(self, text, add_special_tokens=False):
+        ids = []
+        for word in text.split(" "):
+            if word not in self.vocab:
+                self.vocab[word] = len(self.inverse)
+                self.inverse.append(word)
+            ids.append(self.vocab[word])
+        return ids
+
+    def decode(self, ids):
+        return " ".join(self.inverse[i] for i in ids)
+
+    def __call__(self, texts, add_special_tokens=False):
+        return {"input_ids": [self.encode(t) for t in texts]}
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False):
+        text = "".join(f"<|{m['role']}|>\n{m['content']}\n" for m in messages)
+        return text + ("<|assistant|>\n" if add_generation_prompt else "")
+
+
+class StubModelInput:
+    def __init__(self, tokens, text=""):
+        self.tokens = list(tokens)
+        self.text = text
+
+    def to_ints(self):
+        return list(self.tokens)
+
+
+class StubRenderer:
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def build_generation_prompt(self, messages):
+        text = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+        return StubModelInput(self.tokenizer.encode(text), text)
+
+    def get_stop_sequences(self):
+        return []
+
+    def parse_response(self, tokens):
+        return {"role": "assistant", "content": self.tokenizer.decode(tokens)}, True
+
+
+STUB_GENES = ["FBN1", "TGFBR1", "TGFBR2", "SMAD3", "ACTA2", "MYH11", "COL3A1", "None identified"]
+STUB_CODES = ["I71.01", "I71.2", "Q87.19", "Z82.49", "I35.0", "Q23.1", "Z95.2"]
+
+
+def stub_card(prompt_text, rng):
+    """Templated card: echo the profile in the prompt, then invent the rest."""
+    profile = prompt_text.split("\n\n", 1)[-1].rsplit("\n\nBased on", 1)[0]
+    first = rng.randint(38, 55)
+    return (
+        f"{profile}\n\n"
+        f"Genetics:\n- Pathogenic variant: {rng.choice(STUB_GENES)}\n- VUS: None identified\n\n"
+        f"Aortic size:\n- First reported diameter: {first}.{rng.randint(0, 9)} mm\n"
+        f"- Diameter at intervention: {first + rng.randint(2, 9)}.{rng.randint(0, 9)} mm\n\n"
+        f"Billing/Diagnoses:\n- ICD-10 Codes: {', '.join(rng.sample(STUB_CODES, rng.randint(1, 4)))}"
+    )
+
+
+class StubSamplingClient:
+    def __init__(self, model, backend):
+        self.model = model
+        self.backend = backend
+
+    async def _latency(self):
+        b = self.backend
+        b.calls += 1
+        b.in_flight += 1
+        try:
+            if b.capacity and b.in_flight > b.capacity:
+                b.errors += 1
+                raise StubRateLimitError(f"stub: 429 Too Many Requests ({b.in_flight} in flight)")
+            if b.latency > 0:
+                await asyncio.sleep(b.rng.expovariate(1.0 / b.latency))
+            if b.rng.random() < b.error_rate:
+                b.errors += 1
+                raise StubServiceError(f"stub: simulated failure sampling {self.model}")
+        finally:
+            b.in_flight -= 1
+
+    async def sample_async(self, prompt, num_samples=1, sampling_params=None):
+        await self._latency()
+        tok = self.backend.stub_tokenizer
+        sequences = []
+        for _ in range(num_samples):
+            text = self.backend.output_fn(getattr(prompt, "text", ""), self.backend.rng)
+            sequences.append(SimpleNamespace(tokens=tok.encode(text)))
+        return SimpleNamespace(sequences=sequences)
+
+    async def compute_logprobs_async(self, prompt):
+        await self._latency()
+        tokens = prompt.to_ints()
+        seed = int.from_bytes(hashlib.sha256(repr((self.model, tokens)).encode()).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [None] + [-rng.expovariate(1.0) for _ in tokens[1:]]
+
+
+class StubServiceClient:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create_sampling_client(self, model_path=None, base_model=None):
+        return StubSamplingClient(model_path or base_model, self.backend)
+
+
+class StubBackend:
+    name = "stub"
+    sampler_scheme = "stub://"
+    stable_token_ids = False   # StubTokenizer ids are only stable within a process
+
+    def __init__(self, latency=None, error_rate=None, epoch_seconds=None, seed=None,
+                 capacity=None, output_fn=stub_card):
+        env = os.environ.get
+        self.latency = float(env("TINKER_STUB_LATENCY", 0.5) if latency is None else latency)
+        self.error_rate = float(env("TINKER_STUB_ERROR_RATE", 0.05) if error_rate is None else error_rate)
+        self.epoch_seconds = float(env("TINKER_STUB_EPOCH_SECONDS", 1.0) if epoch_seconds is None else epoch_seconds)
+        self.rng = random.Random(int(env("TINKER_STUB_SEED", 0) if seed is None else seed))
+        self.capacity = int(env("TINKER_STUB_CAPACITY", 0) if capacity is None else capacity)
+        self.in_flight = 0
+        self.output_fn = output_fn
+        self.stub_tokenizer = StubTokenizer()
+        self.calls = 0
+        self.errors = 0
+
+    def service_client(self):
+        return StubServiceClient(self)
+
+    def sampling_params(self, **kwargs):
+        return SimpleNamespace(**kwargs)
+
+    def model_input_from_ints(self, tokens):
+        return StubModelInput(tokens, self.stub_tokenizer.decode(tokens))
+
+    def tokenizer(self, model_name):
+        return self.stub_tokenizer
+
+    def renderer(self, tokenizer, name="llama3"):
+        return StubRenderer(tokenizer)
+
+    def make_train_config(self, dataset_path, log_path, model_name, epochs,
+                          learning_rate, lr_schedule, max_length, batch_size,
+                          lora_rank=32, eval_every=10, batch_plan=None):
+        return SimpleNamespace(dataset_path=dataset_path, log_path=log_path, model_name=model_name,
+                               num_epochs=epochs, learning_rate=learning_rate, lr_schedule=lr_schedule,
+                               max_length=max_length, batch_size=batch_size, lora_rank=lora_rank,
+                               eval_every=eval_every, batch_plan=batch_plan)
+
+    def check_log_dir(self, log_path, resume=False):
+        ckpt = os.path.join(log_path, "checkpoints.jsonl")
+        if os.path.exists(ckpt) and not resume:
+            os.remove(ckpt)
+
+    async def train(self, config):
+        """
+        Write one sampler checkpoint per epoch (and a final one) to checkpoints.jsonl,
+        continuing after the last epoch already in the file (resume).
+        """
+        os.makedirs(config.log_path, exist_ok=True)
+        with open(config.dataset_path) as f:
+            n_records = sum(1 for line in f if line.strip())
+        run_id = hashlib.sha256(config.log_path.encode()).hexdigest()[:12]
+        steps_per_epoch = max(1, -(-n_records // config.batch_size))
+        if config.batch_plan:
+            with open(config.batch_plan) as f:
+                steps_per_epoch = max(1, len(json.load(f)["batches"]))
+        ckpt_file = os.path.join(config.log_path, "checkpoints.jsonl")
+        start_epoch = 0
+        if os.path.exists(ckpt_file):
+            with open(ckpt_file) as f:
+                done = [json.loads(line) for line in f if line.strip()]
+            start_epoch = max((e["epoch"] for e in done if e.get("state_path")), default=0)
+        for epoch in range(start_epoch + 1, config.num_epochs + 1):
+            await asyncio.sleep(self.epoch_seconds)
+            name = "final" if epoch == config.num_epochs else f"{epoch * steps_per_epoch:06d}"
+            entry = {
+                "name":         name,
+                "epoch":        epoch,
+                "batch":        epoch * steps_per_epoch,
+                "state_path":   f"stub://{run_id}:train:0/weights/{name}",
+                "sampler_path": f"stub://{run_id}:train:0/sampler_weights/{name}",
+            }
+            with open(ckpt_file, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+
+# ── Selection ─────────────────────────────────────────────────────────────────
+
+BACKENDS = {"tinker": TinkerBackend, "stub": StubBackend}
+
+
+def get_backend(name=None):
+    """Process-wide backend instance (name defaults to $TINKER_BACKEND, then 'tinker')."""
+    name = name or os.environ.get(BACKEND_ENV, "tinker")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown Tinker backend {name!r}; choose from {list(BACKENDS)}")
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+def set_backend(backend):
+    """Install a configured backend instance (e.g. StubBackend(error_rate=0.2)) as the default."""
+    _backends[backend.name] = backend
+    os.environ[BACKEND_ENV] = backend.name
+    for key in [k for k in _resources if k[0] == backend.name]:
+        del _resources[key]
+
+
+# ── Shared resources ──────────────────────────────────────────────────────────
+
+def _cached(key, load):
+    backend = get_backend()
+    key = (backend.name,) + key
+    if key not in _resources:
+        _resources[key] = load(backend)
+    return _resources[key]
+
+
+def shared_tokenizer(model_name=BASE_MODEL):
+    return _cached(("tokenizer", model_name), lambda b: b.tokenizer(model_name))
+
+
+def shared_renderer(model_name=BASE_MODEL, renderer_name=RENDERER_NAME):
+    return _cached(("renderer", model_name, renderer_name),
+                   lambda b: b.renderer(shared_tokenizer(model_name), renderer_name))
+
+
+def shared_service_client():
+    return _cached(("service",), lambda b: b.service_client())
+
+
+def sampling_client(model_path=None, base_model=None):
+    """Sampling client for a fine-tuned model_path or a base_model, one per URI per process."""
+    if (model_path is None) == (base_model is None):
+        raise ValueError("Pass exactly one of model_path or base_model")
+    if model_path is not None:
+        return _cached(("sampling", "model_path", model_path),
+                       lambda b: shared_service_client().create_sampling_client(model_path=model_path))
+    return _cached(("sampling", "base_model", base_model),
+                   lambda b: shared_service_client().create_sampling_client(base_model=base_model))
@@ -0,0 +1,173 @@
+"""
+token_cache.py
+─────────────────────────────────────────────────────────────────────────────
+Cached Llama-3.1 token counts for training records and eval prompts.
+
+Every text is rendered with the model's chat template and keyed by the
+SHA-256 of the rendered string plus the tokenizer name, so each distinct
+card / prompt is tokenized once no matter how many files or scripts
+contain it. Counts from a non-default backend (e.g. the offline stub's
+whitespace tokenizer) are stored under "<backend>:<tokenizer>", so they are
+never read back as real Llama-3.1 counts. Counts live in SQLite:
+
+  token_counts   text_sha256 | tokenizer | n_tokens
+
+Default database: data/processed/cache/token_counts.sqlite
+(override with the TOKEN_CACHE_PATH environment variable).
+
+    cache = TokenCache()
+    counts = cache.count_file("data/processed/tinker_train_M1_full.jsonl")
+    print(length_stats(counts, max_length=4096))
+"""
+
+import os
+import json
+import math
+import sqlite3
+
+from config import PROCESSED_DIR
+from fingerprint import sha256_text
+
+TOKEN_CACHE_PATH = os.environ.get("TOKEN_CACHE_PATH",
+                                  os.path.join(PROCESSED_DIR, "cache", "token_counts.sqlite"))
+TOKENIZER_NAME = "meta-llama/Llama-3.1-8B-Instruct"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_counts (
+    text_sha256  TEXT NOT NULL,
+    tokenizer    TEXT NOT NULL,
+    n_tokens     INTEGER NOT NULL,
+    PRIMARY KEY (text_sha256, tokenizer)
+);
+"""
+
+_ENCODE_BATCH = 256
+
+
+def _load_tokenizer(name):
+    from tinker_backend import shared_tokenizer
+    return shared_tokenizer(name)
+
+
+def _cache_key(tokenizer_name):
+    """Tokenizer column value: the plain name for the real backend, '<backend>:<name>' otherwise."""
+    from tinker_backend import get_backend
+    backend = get_backend().name
+    return tokenizer_name if backend == "tinker" else f"{backend}:{tokenizer_name}"
+
+
+def record_messages(rec):
+    """Chat messages of a training record ({"messages": ...}) or eval prompt ({"prompt_text": ...})."""
+    if "messages" in rec:
+        return rec["messages"], False
+    return [{"role": "user", "content": rec["prompt_text"]}], True
+
+
+class TokenCache:
+    """Token counts keyed by (sha256 of rendered text, tokenizer name)."""
+
+    def __init__(self, db_path=None, tokenizer_name=TOKENIZER_NAME):
+        self.db_path = db_path or TOKEN_CACHE_PATH
+        self.tokenizer_name = tokenizer_name
+        self.cache_key = _cache_key(tokenizer_name)
+        self._tokenizer = None
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = _load_tokenizer(self.tokenizer_name)
+        return self._tokenizer
+
+    def render(self, messages, add_generation_prompt=False):
+        return self.tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=add_generation_prompt
+        )
+
+    def _lookup(self, keys):
+        found = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT text_sha256, n_tokens FROM token_counts "
+                f"WHERE tokenizer=? AND text_sha256 IN ({','.join('?' * len(chunk))})",
+                [self.cache_key, *chunk],
+            )
+            found.update(rows)
+        return found
+
+    def count_texts(self, texts):
+        """Token counts for already-rendered texts; only cache misses are tokenized."""
+        keys = [sha256_text(t) for t in texts]
+        known = self._lookup(sorted(set(keys)))
+        missing = {k: t for k, t in zip(keys, texts) if k not in known}
+        self.hits += len(keys) - sum(k in missing for k in keys)
+        self.misses += len(missing)
+
+        items = list(missing.items())
+        for i in range(0, len(items), _ENCODE_BATCH):
+            batch = items[i:i + _ENCODE_BATCH]
+            encoded = self.tokenizer([t for _, t in batch], add_special_tokens=False)["input_ids"]
+            rows = [(k, self.cache_key, len(ids)) for (k, _), ids in zip(batch, encoded)]
+            self.conn.executemany("INSERT OR REPLACE INTO token_counts VALUES (?, ?, ?)", rows)
+            known.update((k, n) for k, _, n in rows)
+        self.conn.commit()
+        return [known[k] for k in keys]
+
+    def count_records(self, records):
+        """Token counts of training records / eval prompts as the model sees them."""
+        texts = [self.render(*record_messages(r)) for r in records]
+        return self.count_texts(texts)
+
+    def count_file(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return self.count_records([json.loads(line) for line in f if line.strip()])
+
+    def close(self):
+        self.conn.close()
+
+
+def _percentile(sorted_vals, q):
+    if not sorted_vals:
+        return 0
+    idx = min(len(sorted_vals) - 1, max(0, math.ceil(q * len(sorted_vals)) - 1))
+    return sorted_vals[idx]
+
+
+def length_stats(counts, max_length=None):
+    """Distribution summary; n_truncated counts records longer than max_length."""
+    vals = sorted(counts)
+    n = len(vals)
+    stats = {
+        "n":            n,
+        "total_tokens": sum(vals),
+        "min":          vals[0] if n else 0,
+        "mean":         round(sum(vals) / n, 1) if n else 0,
+        "p50":          _percentile(vals, 0.50),
+        "p90":          _percentile(vals, 0.90),
+        "p99":          _percentile(vals, 0.99),
+        "max":          vals[-1] if n else 0,
+    }
+    if max_length is not None:
+        stats["max_length"] = max_length
+        stats["n_truncated"] = sum(v > max_length for v in vals)
+    return stats
+
+
+def suggest_lengths(counts, cap, tokens_per_batch=None, default_batch_size=4, multiple=256):
+    """
+    (max_length, batch_size) for a training file: the smallest multiple of
+    `multiple` covering the longest record (never above `cap`), and — when a
+    tokens_per_batch budget is given — the batch size that fills it at the
+    mean record length.
+    """
+    longest = max(counts) if counts else cap
+    max_length = min(cap, multiple * math.ceil(longest / multiple))
+    batch_size = default_batch_size
+    if tokens_per_batch and counts:
+        batch_size = max(1, int(tokens_per_batch // (sum(counts) / len(counts))))
+    return max_length, batch_size